@@ -0,0 +1,227 @@
+# -*- coding: utf-8 -*-
+import csv
+import io
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+try:
+    import constants
+    API_URL = constants.API_KEY
+except ImportError:  # APIキー(constants.py)が無い環境ではパース処理のみ利用できる
+    API_URL = None
+# 環境変数で接続先を差し替えられる(mock_airoco.py などオフラインでの検証用)
+API_URL = os.environ.get('AIROCO_API_URL') or API_URL
+
+
+DAY_SECONDS = 3600 * 24          # 1チャンク(1日)の秒数
+SENSOR_NAME = 'Ｒ３ー４０１'      # 取得対象のセンサー名
+REQUEST_TIMEOUT = (3.05, 10)     # (接続, 読み込み) のタイムアウト秒
+MAX_RETRIES = 3                  # チャンクごとの再試行回数
+POOL_SIZE = 8                    # 同時接続数(=並列取得数の上限)
+
+# day-csvの列: 1列目がセンサー名、3～6列目がCO2濃度, 気温, 湿度, タイムスタンプ
+CSV_COLUMNS = (1, 3, 4, 5, 6)
+ROW_DTYPE = np.dtype([
+    ('sensor', 'U32'),
+    ('co2', '<f8'),
+    ('temp', '<f8'),
+    ('humid', '<f8'),
+    ('timestamp', '<f8'),
+])
+VALUE_COLUMNS = ('co2', 'temp', 'humid', 'timestamp')
+
+_session = None
+
+
+class FetchError(Exception):
+    """要求した日チャンクを1つも取得できなかった"""
+
+
+def get_session() -> requests.Session:
+    """接続プールと再試行設定を持つSessionを返す(初回のみ生成)"""
+    global _session
+    if _session is None:
+        retry = Retry(
+            total=MAX_RETRIES,
+            backoff_factor=0.5,                           # 0.5, 1, 2秒...と間隔を空けて再試行
+            status_forcelist=(429, 500, 502, 503, 504),
+            allowed_methods=frozenset(['GET']),
+        )
+        adapter = HTTPAdapter(pool_connections=POOL_SIZE, pool_maxsize=POOL_SIZE, max_retries=retry)
+        session = requests.Session()
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        _session = session
+    return _session
+
+
+def fetch_day_chunk(start_time: int, session: requests.Session = None):
+    """startTimeから1日分のCSV本文を取得する。失敗時はNoneを返す"""
+    session = session or get_session()
+    try:
+        res = session.get(f'{API_URL}&startDate={start_time}', timeout=REQUEST_TIMEOUT)
+        res.raise_for_status()  # HTTPエラーがあれば例外を発生
+        return res.text
+    except requests.exceptions.RequestException as e:
+        print(f"API request failed: {e}")
+        return None
+
+
+def _has_header(text: str) -> bool:
+    """先頭行のCO2列が数値でなければヘッダ行とみなす"""
+    first = next(csv.reader([text.split('\n', 1)[0]]), [])
+    try:
+        float(first[CSV_COLUMNS[1]])
+        return False
+    except (IndexError, ValueError):
+        return True
+
+
+def _load_day_csv_slow(text: str) -> np.ndarray:
+    """不正な行を読み飛ばしながら1行ずつパースする(一括パースに失敗した時用)"""
+    rows = []
+    for row in csv.reader(text.splitlines()):
+        try:
+            rows.append(tuple(row[i] if i == 1 else float(row[i]) for i in CSV_COLUMNS))
+        except (IndexError, ValueError):
+            continue
+    return np.array(rows, dtype=ROW_DTYPE)
+
+
+def load_day_csv(text: str) -> np.ndarray:
+    """CSV本文全体を1回のパースで全センサー分の構造化配列(ROW_DTYPE)に変換する"""
+    text = text.lstrip('\ufeff').strip()
+    header = _has_header(text)
+    # 空の本文やヘッダ行だけ(センサー停止日など)は loadtxt の警告を出さずに空で返す
+    if not text or (header and '\n' not in text):
+        return np.empty(0, dtype=ROW_DTYPE)
+    try:
+        return np.loadtxt(
+            io.StringIO(text),
+            delimiter=',',
+            quotechar='"',
+            comments=None,
+            usecols=CSV_COLUMNS,
+            dtype=ROW_DTYPE,
+            skiprows=1 if header else 0,
+            ndmin=1,
+        )
+    except ValueError:
+        return _load_day_csv_slow(text)
+
+
+def to_columns(table: np.ndarray) -> np.ndarray:
+    """構造化配列を [CO2濃度, 気温, 湿度, タイムスタンプ] の (n, 4) float64配列に変換する"""
+    data = np.empty((len(table), len(VALUE_COLUMNS)), dtype=np.float64)
+    for i, column in enumerate(VALUE_COLUMNS):
+        data[:, i] = table[column]
+    return data
+
+
+def parse_day_csv(text: str, sensor: str = SENSOR_NAME) -> np.ndarray:
+    """CSV本文から対象センサーの行をマスクで抽出し、(n, 4) の配列で返す"""
+    table = load_day_csv(text)
+    return to_columns(table[table['sensor'] == sensor])
+
+
+def split_by_sensor(table: np.ndarray) -> dict:
+    """全センサー分の構造化配列を、センサー名ごとの (n, 4) 配列に一括で振り分ける"""
+    if len(table) == 0:
+        return {}
+    names, inverse = np.unique(table['sensor'], return_inverse=True)
+    order = np.argsort(inverse, kind='stable')              # センサー順に並べる(各センサー内の順序は維持)
+    bounds = np.searchsorted(inverse[order], np.arange(1, len(names)))
+    parts = np.split(to_columns(table[order]), bounds)
+    return {str(name): part for name, part in zip(names, parts)}
+
+
+def parse_all_sensors(text: str) -> dict:
+    """CSV本文を1回だけパースし、センサー名ごとの (n, 4) 配列を返す"""
+    return split_by_sensor(load_day_csv(text))
+
+
+def _download(start_times: list, strict: bool = False) -> tuple:
+    """複数の日チャンクを並列に取得し、(取得できた本文のリスト, 取得できなかった開始時刻のリスト) を返す
+
+    strict=True の場合、1つも取得できなければ FetchError を送出する(「データ無し」と区別するため)。
+    一部だけ失敗した場合は取得できた分を返すので、失敗した日は呼び出し側で取り直すこと。
+    """
+    if not start_times:
+        return [], []
+    session = get_session()
+    with ThreadPoolExecutor(max_workers=min(POOL_SIZE, len(start_times))) as pool:
+        texts = list(pool.map(lambda t: fetch_day_chunk(t, session), start_times))
+    failed = [start_time for start_time, text in zip(start_times, texts) if text is None]
+    if strict and len(failed) == len(start_times):
+        raise FetchError(f'{len(start_times)}件の日チャンクをすべて取得できませんでした')
+    return [text for text in texts if text], failed
+
+
+def _merge_chunks(chunks: list) -> np.ndarray:
+    """チャンクごとの (n, 4) 配列を連結し、タイムスタンプ順に並べる"""
+    chunks = [chunk for chunk in chunks if len(chunk)]
+    if not chunks:
+        return np.empty((0, len(VALUE_COLUMNS)))
+    data = np.concatenate(chunks)
+    return data[np.argsort(data[:, 3], kind='stable')]
+
+
+def load_days(texts: list, sensor: str = SENSOR_NAME) -> np.ndarray:
+    """記録・合成した日チャンクの本文のリストを、時刻順で同じ時刻の行が1つだけの (n, 4) の配列にする
+
+    日チャンクは重なるので同じ時刻の行は1つにまとめる(フィクスチャや合成データを検証に使う時用)。
+    """
+    data = _merge_chunks([parse_day_csv(text, sensor) for text in texts if text])
+    _, unique = np.unique(data[:, 3], return_index=True)
+    return data[unique]
+
+
+def fetch_days(start_times: list, sensor: str = SENSOR_NAME, strict: bool = False, failed: list = None) -> np.ndarray:
+    """複数の日チャンクを並列に取得し、タイムスタンプ順に並べた (n, 4) の配列を返す
+
+    failedにリストを渡すと、取得できなかった日チャンクの開始時刻を追加する(取り直すため)。
+    """
+    texts, missed = _download(start_times, strict)
+    if failed is not None:
+        failed.extend(missed)
+    return _merge_chunks([parse_day_csv(text, sensor) for text in texts])
+
+
+def fetch_days_by_sensor(start_times: list, strict: bool = False, failed: list = None) -> dict:
+    """複数の日チャンクを1回ずつだけ取得して全センサー分をパースし、センサー名ごとの (n, 4) 配列を返す
+
+    部屋ごとに取得し直さずに済むよう、チャンクごとに parse_all_sensors で振り分けてから連結する。
+    failedは fetch_days と同じ。
+    """
+    texts, missed = _download(start_times, strict)
+    if failed is not None:
+        failed.extend(missed)
+    per_sensor = {}
+    for text in texts:
+        for name, part in parse_all_sensors(text).items():
+            per_sensor.setdefault(name, []).append(part)
+    return {name: _merge_chunks(parts) for name, parts in per_sensor.items()}
+
+
+def fetch_past_days(days: int = 7, now: int = None, sensor: str = SENSOR_NAME) -> np.ndarray:
+    """過去days日分のチャンクをまとめて取得する"""
+    now = int(time.time()) if now is None else now
+    return fetch_days([now - DAY_SECONDS * i for i in range(days, 0, -1)], sensor)
+
+
+def fetch_since(start_time: float, now: int = None, sensor: str = SENSOR_NAME, strict: bool = False,
+                failed: list = None) -> np.ndarray:
+    """start_time以降、現在までを覆う日チャンクをまとめて取得する(キャッシュの差分埋め用)"""
+    now = int(time.time()) if now is None else now
+    return fetch_days(day_starts(start_time, now), sensor, strict, failed)
+
+
+def day_starts(start_time: float, now: float) -> list:
+    """start_time以降、nowまでを覆う日チャンクの開始時刻のリスト"""
+    return list(range(int(start_time), int(now), DAY_SECONDS))
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""複数のボットを同じ価格データ・同じルールで競わせるアリーナ(pygame不要)
+
+ボット(bots.py 参照)は "モジュール名:関数名" で指定し、エージェントごとに seed を変えて作る。
+エージェントはプロセスプールの各プロセスに分けて実行し、結果は server.UserDB と同じ
+ランキングのスキーマ(users テーブル)に書き込む。--post を指定するとAPIサーバに送信する(負荷試験用)。
+
+価格は記録したセンサー履歴を TICK_SECONDS ごとに進め、その時点の最新値と1つ前の値を
+price_desk の形でボットに渡す。注文は trading.Portfolio で処理し、短時間モードの交渉価格の更新と
+強制売却も main.py と同じ間隔で行う。
+使い方: python arena.py [--replay DIR | --synthetic] [--agents 1000] [--bots bots:hold bots:mean_reversion ...] [--workers N] [--db arena.db] [--post URL]
+"""
+import argparse
+import datetime
+import importlib
+import os
+import time
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from types import MappingProxyType, SimpleNamespace
+
+import numpy as np
+import requests
+
+import backtest
+import server
+import trading
+
+
+TICK_SECONDS = trading.TICK_SECONDS   # 注文と交渉価格の更新の間隔(main.UPDATE_INTERVAL_MS と同じ)
+INITIAL_MONEY = 10000         # server.UserDB.is_registered の初期所持金と同じ
+DEFAULT_BOTS = ('bots:hold', 'bots:random_trader', 'bots:mean_reversion', 'bots:special_gambler')
+
+
+def load_bot(path: str):
+    """"モジュール名:関数名" からボットを作る関数を取り出す"""
+    module, _, name = path.partition(':')
+    return getattr(importlib.import_module(module), name)
+
+
+def make_ticks(history: dict, tickers: tuple = trading.TICKERS) -> tuple:
+    """TICK_SECONDSごとの (時刻のリスト, price_deskのリスト)
+
+    price_desk はボットの間で共有するので、書き換えられないよう読み取り専用のビュー(MappingProxyType)にする。
+    """
+    timestamps = np.asarray(history['timestamp'])
+    clock = np.arange(timestamps[1], timestamps[-1] + 1, TICK_SECONDS)
+    index = np.searchsorted(timestamps, clock, side='right') - 1   # その時点で届いている最新のサンプル
+    now = {ticker: np.asarray(history[ticker])[index].tolist() for ticker in tickers}
+    last = {ticker: np.asarray(history[ticker])[index - 1].tolist() for ticker in tickers}
+    times = [datetime.datetime.fromtimestamp(t) for t in clock.tolist()]
+    desks = [
+        MappingProxyType({ticker: MappingProxyType({"now_price": now[ticker][i], "last_price": last[ticker][i]})
+                          for ticker in tickers})
+        for i in range(len(clock))
+    ]
+    return times, desks
+
+
+def account_view(portfolio: trading.Portfolio) -> SimpleNamespace:
+    """ボットに渡す所持金・保有株・短時間モードの状態の写し
+
+    ボットには Portfolio そのものを渡さない(所持金の書き換えや buy_special の直接呼び出しで
+    人間のプレイヤーと違うルールにならないように)。注文は execute() だけが処理する。
+    """
+    return SimpleNamespace(
+        money=portfolio.money,
+        stocks={ticker: dict(position) for ticker, position in portfolio.stocks.items()},
+        special_state=dict(portfolio.special_state),
+    )
+
+
+def execute(portfolio: trading.Portfolio, order: tuple, price_desk: dict, now: datetime.datetime):
+    """ボットの注文を1つ処理する。通らなかった注文はNoneを返す(人間のプレイヤーと同じ)"""
+    side, ticker = order[0], order[1]
+    if ticker not in price_desk:
+        return None
+    price = price_desk[ticker]["now_price"]
+    if price == 0:   # main.py と同じく、現在の価格が0の時(データ取得前など)は何もできない
+        return None
+    if side == "buy":
+        return portfolio.buy(ticker, price)
+    if side == "sell":
+        return portfolio.sell(ticker, price)
+    if side == "special":
+        if portfolio.special_state[ticker] != trading.SPECIAL_OFF:
+            return None
+        portfolio.toggle_special(ticker)
+        fill = portfolio.buy_special(ticker, int(order[2]), price, now)
+        if fill is None:
+            portfolio.toggle_special(ticker)   # 買えなければ取りやめる
+        return fill
+    return None
+
+
+def play(policy, times: list, desks: list, money: int = INITIAL_MONEY) -> tuple:
+    """1体のボットを最初から最後まで動かし、(Portfolio, 約定数, エラー) を返す
+
+    ボットに渡す写し(account_view)は、約定・交渉価格の更新・価格の変化があった時だけ作り直す。
+    """
+    portfolio = trading.Portfolio(money=money)
+    fills = 0
+    view = None
+    for now, price_desk in zip(times, desks):
+        if view is None:
+            view = account_view(portfolio)
+        try:
+            orders = policy(price_desk, view) or []
+        except Exception as e:   # 1体のボットの不具合でアリーナ全体を止めない
+            return portfolio, fills, repr(e)
+        changed = False
+        for order in orders:
+            if execute(portfolio, order, price_desk, now) is not None:
+                fills += 1
+                changed = True
+        # 短時間モードの交渉価格の更新と強制売却(main.py の UPDATE_DATA_EVENT と同じ)
+        for ticker in portfolio.special_state:
+            if portfolio.special_state[ticker] == trading.SPECIAL_ACTIVE:
+                changed = True
+                desk = price_desk[ticker]
+                if portfolio.tick(ticker, desk["now_price"], desk["last_price"], now) is not None:
+                    fills += 1
+        prices = {ticker: desk["now_price"] for ticker, desk in price_desk.items()}
+        if changed or prices != portfolio.prices:   # 価格が変わると保有株の損益が変わる
+            view = None
+        portfolio.update_prices(prices)
+    return portfolio, fills, None
+
+
+def run_shard(agents: list, history: dict, money: int = INITIAL_MONEY) -> list:
+    """(名前, ボット, seed) のリストを順に動かし、結果の辞書のリストを返す(プロセスプールで実行)"""
+    times, desks = make_ticks(history)
+    results = []
+    for name, bot, seed in agents:
+        portfolio, fills, error = play(load_bot(bot)(seed), times, desks, money)
+        results.append({
+            "user_name": name,
+            "bot": bot,
+            "money": int(portfolio.money),
+            # client.post_user_data と同じ形
+            "stocks": {ticker: {"stock": position["stock"], "special_stocks": position["special_stocks"]}
+                       for ticker, position in portfolio.stocks.items()},
+            "profit": portfolio.total_profit,
+            "fills": fills,
+            "error": error,
+        })
+    return results
+
+
+def run_arena(agents: list, history: dict, workers: int = None, money: int = INITIAL_MONEY) -> list:
+    """エージェントをworkers個のプロセスに分けて動かし、全員の結果を返す"""
+    workers = workers or os.cpu_count() or 1
+    shards = [agents[i::workers * 4] for i in range(min(len(agents), workers * 4))]
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(run_shard, shard, history, money) for shard in shards]
+        return [result for future in futures for result in future.result()]
+
+
+def save_results(results: list, db_name: str = server.UserDB.DB_NAME) -> None:
+    """結果をランキングのDB(users テーブル)に書き込む"""
+    user_db = server.UserDB(db_name)
+    for result in results:
+        user_db.set_user_data(result["user_name"], result["money"], result["stocks"])
+
+
+def post_results(results: list, url: str, concurrency: int = 8) -> dict:
+    """結果をAPIサーバにPOSTし(client.post_user_data と同じ形)、ステータスコードごとの件数を返す"""
+    session = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(pool_maxsize=concurrency)
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+
+    def post(result):
+        payload = {"user_name": result["user_name"], "money": result["money"], "stocks": result["stocks"]}
+        try:
+            return session.post(url, json=payload, timeout=10).status_code
+        except requests.RequestException as e:
+            return type(e).__name__
+
+    counts = defaultdict(int)
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for status in pool.map(post, results):
+            counts[status] += 1
+    return dict(counts)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='ボットを競わせるアリーナ')
+    parser.add_argument('--replay', help='記録したフィクスチャのディレクトリ(mock_airoco.py --record)')
+    parser.add_argument('--synthetic', action='store_true', help='履歴キャッシュの代わりに合成データを使う(動作確認用)')
+    parser.add_argument('--days', type=int, default=7)
+    parser.add_argument('--agents', type=int, default=1000)
+    parser.add_argument('--bots', nargs='+', default=list(DEFAULT_BOTS), help='"モジュール名:関数名" のボット(順番に割り当てる)')
+    parser.add_argument('--workers', type=int, help='プロセス数(既定はCPU数)')
+    parser.add_argument('--money', type=int, default=INITIAL_MONEY)
+    parser.add_argument('--prefix', default='bot', help='ランキングに載せる名前の接頭辞')
+    parser.add_argument('--db', default='arena.db', help='結果を書き込むDB(server.py と同じスキーマ)')
+    parser.add_argument('--post', help='結果を送信するAPIサーバのURL(例: http://localhost:5000)')
+    parser.add_argument('--concurrency', type=int, default=8, help='--post の同時接続数')
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+
+    for bot in args.bots:
+        load_bot(bot)   # 名前の間違いは先に知らせる
+    try:
+        history = backtest.load_history(args.replay, args.days, synthetic=args.synthetic)
+    except ValueError as e:
+        parser.error(str(e))
+    agents = [(f'{args.prefix}-{bot.split(":")[-1]}-{i}', bot, i)
+              for i, bot in zip(range(args.agents), args.bots * (args.agents // len(args.bots) + 1))]
+
+    start = time.perf_counter()
+    results = run_arena(agents, history, args.workers, args.money)
+    elapsed = time.perf_counter() - start
+    ticks = len(make_ticks(history)[0])
+    print(f'{len(results)}体 x {ticks}ティック: {elapsed:.2f}秒 ({len(results) * ticks / elapsed:,.0f}ティック/秒)')
+
+    print(f'\n{"bot":<28}{"agents":>8}{"money avg":>12}{"money max":>12}{"fills avg":>11}{"errors":>8}')
+    by_bot = defaultdict(list)
+    for result in results:
+        by_bot[result["bot"]].append(result)
+    for bot, rows in by_bot.items():
+        money = np.array([row["money"] for row in rows])
+        fills = np.mean([row["fills"] for row in rows])
+        errors = sum(row["error"] is not None for row in rows)
+        print(f'{bot:<28}{len(rows):>8}{money.mean():>12,.0f}{money.max():>12,}{fills:>11.1f}{errors:>8}')
+
+    save_results(results, args.db)
+    print(f'\n{args.db} に書き込みました。上位{args.top}件:')
+    for rank, row in server.UserDB(args.db).get_top_ranking(args.top).items():
+        print(f'{rank:>4} {row["user_name"]:<32}{row["money"]:>10,}')
+
+    if args.post:
+        start = time.perf_counter()
+        counts = post_results(results, args.post, args.concurrency)
+        elapsed = time.perf_counter() - start
+        print(f'\n{args.post} に{len(results)}件送信: {elapsed:.2f}秒 ({len(results) / elapsed:,.0f}件/秒) {counts}')
+
+
+if __name__ == '__main__':
+    main()
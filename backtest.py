@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""保存済みのセンサー履歴に対して売買戦略を一括で検証するバックテスト(pygame不要)
+
+手数料や売買単位は trading.py と同じ(売却時10%の手数料、CO2株は1株・気温/湿度株は10株単位、
+金額はint()で切り捨て)。パラメータの組み合わせを行、時刻を列にした (組み合わせ数, 時刻数) の
+配列で全ての組み合わせを同時に計算するので、1週間分 × 数千通りでも数秒で終わる。
+使い方: python backtest.py [--replay DIR | --synthetic] [--days 7] [--tickers co2 temp humid] [--top 10] [--csv out.csv]
+"""
+import argparse
+import csv
+import itertools
+import time
+
+import numpy as np
+
+import airoco
+import history_cache
+import mock_airoco
+import series_store
+import trading
+
+
+SAMPLES_PER_HOUR = 3600 // series_store.SAMPLE_INTERVAL
+
+# 既定のパラメータの範囲(平均を取る時間, 平均からの下落率で買う, 平均からの上昇率で売る)
+DEFAULT_WINDOW_HOURS = (1, 3, 6, 12, 24)
+DEFAULT_DROPS = tuple(np.round(np.arange(0.01, 0.21, 0.01), 2))
+DEFAULT_RISES = tuple(np.round(np.arange(-0.05, 0.151, 0.01), 2))
+
+
+def load_history(replay: str = None, days: int = 7, sensor: str = airoco.SENSOR_NAME, synthetic: bool = False) -> dict:
+    """検証に使う列の辞書(co2/temp/humid/timestamp)。直近days日分を返す
+
+    replayを指定すると記録したフィクスチャ、synthetic=True なら合成データ(mock_airoco)、
+    どちらも無ければローカルの履歴キャッシュを使う。キャッシュが空なら ValueError を送出する
+    (合成データの結果を実際の価格と取り違えないよう、黙って切り替えない)。
+    """
+    if replay:
+        fixtures = mock_airoco.FixtureStore(replay)
+        data = airoco.load_days([fixtures.load(start_time) for start_time in fixtures.start_times()], sensor)
+    elif synthetic:
+        print('[WARN] 合成データ(mock_airoco)を使います。実際のセンサーの価格ではありません。')
+        data = airoco.load_days(mock_airoco.synthetic_days(days), sensor)
+    else:
+        cached = history_cache.HistoryCache(sensor).load()
+        data = np.column_stack([np.array(cached[column]) for column in history_cache.COLUMNS])
+        if len(data) == 0:
+            raise ValueError(f'履歴キャッシュ({history_cache.CACHE_DIR}/{sensor})が空です。'
+                             '--replay でフィクスチャを指定するか、--synthetic で合成データを使ってください')
+
+    data = data[data[:, 3] >= data[-1, 3] - days * airoco.DAY_SECONDS] if len(data) else data
+    return {column: data[:, i] for i, column in enumerate(history_cache.COLUMNS)}
+
+
+def rolling_mean(values: np.ndarray, window: int) -> np.ndarray:
+    """直近window件の平均。件数が揃うまではNaN"""
+    cumsum = np.concatenate(([0.0], np.cumsum(values, dtype=np.float64)))
+    mean = np.full(len(values), np.nan)
+    if window <= len(values):
+        mean[window - 1:] = (cumsum[window:] - cumsum[:-window]) / window
+    return mean
+
+
+def deviation(values: np.ndarray, hours: float) -> tuple:
+    """直近hours時間の平均からのずれ(割合)と、平均が計算できた時刻のマスク"""
+    mean = rolling_mean(values, max(1, int(hours * SAMPLES_PER_HOUR)))
+    ready = ~np.isnan(mean)
+    return np.where(ready, values / np.where(ready, mean, 1.0) - 1, 0.0), ready
+
+
+def positions(entries: np.ndarray, exits: np.ndarray) -> np.ndarray:
+    """買いシグナル(entries)で1単位持ち、売りシグナル(exits)で手放した時の保有状態 (組み合わせ数, 時刻数)
+
+    状態は直前のシグナルだけで決まるので、シグナルのあった位置を前方に伸ばして求める。
+    同じ時刻に両方出た場合は売りを優先する。
+    """
+    signal = np.where(exits, -1, np.where(entries, 1, 0)).astype(np.int8)
+    index = np.where(signal != 0, np.arange(signal.shape[1]), 0)
+    np.maximum.accumulate(index, axis=1, out=index)
+    return np.take_along_axis(signal, index, axis=1) == 1
+
+
+def simulate(prices: np.ndarray, entries: np.ndarray, exits: np.ndarray, ticker: str) -> dict:
+    """シグナルの組み合わせごとに売買し、損益を返す
+
+    買いは trading.Portfolio.buy と同じく LOT_SIZES 単位で int(価格 * 株数)、売りは1株ずつ
+    int(価格 * SELL_RATE) で、最後に持っていれば最終時刻の価格で売ったものとする。
+    価格が0以下の時刻のシグナルは無視する。所持金の不足は考えない(1単位しか持たないので通常は問題にならない)。
+    """
+    lot = trading.LOT_SIZES.get(ticker, 1)
+    buy_cost = np.trunc(prices * lot)                          # 1回の購入金額
+    sell_proceeds = np.trunc(prices * trading.SELL_RATE) * lot  # 1単位を1株ずつ売った合計
+    tradable = prices > 0                                       # 価格が0以下の時は売買できない(trading.Portfolio と同じ)
+    held = positions(entries & tradable, exits & tradable)
+    held[:, -1] = False   # 最終時刻で手仕舞う
+
+    changed = np.diff(held, axis=1, prepend=False, append=False)
+    opened = changed[:, :-1] & held
+    closed = changed[:, :-1] & ~held                           # 保有していた最後の時刻の次で売る
+
+    spent = opened.astype(np.float64) @ buy_cost
+    earned = closed.astype(np.float64) @ sell_proceeds
+    trades = opened.sum(axis=1)
+    return {'profit': earned - spent, 'trades': trades, 'spent': spent}
+
+
+def mean_reversion(values: np.ndarray, window_hours=DEFAULT_WINDOW_HOURS, drops=DEFAULT_DROPS,
+                   rises=DEFAULT_RISES, ticker: str = 'co2') -> dict:
+    """「直近window時間の平均よりdrop下がったら買い、平均よりrise上がったら売る」を全ての組み合わせで検証する
+
+    パラメータと結果を組み合わせごとの1次元配列の辞書で返す。
+    """
+    drops = np.asarray(drops, dtype=np.float64)
+    rises = np.asarray(rises, dtype=np.float64)
+    drop_grid, rise_grid = (grid.ravel() for grid in np.meshgrid(drops, rises, indexing='ij'))
+    columns = {'window_hours': [], 'drop': [], 'rise': [], 'profit': [], 'trades': []}
+    for hours in window_hours:
+        ratio, ready = deviation(values, hours)
+        entries = ready & (ratio <= -drop_grid[:, None])
+        exits = ready & (ratio >= rise_grid[:, None])
+        result = simulate(values, entries, exits, ticker)
+        columns['window_hours'].append(np.full(len(drop_grid), hours, dtype=np.float64))
+        columns['drop'].append(drop_grid)
+        columns['rise'].append(rise_grid)
+        columns['profit'].append(result['profit'])
+        columns['trades'].append(result['trades'])
+    return {name: np.concatenate(parts) for name, parts in columns.items()}
+
+
+def replay(values: np.ndarray, entries: np.ndarray, exits: np.ndarray, ticker: str) -> float:
+    """1つの組み合わせを trading.Portfolio で1時刻ずつ再生した損益(simulate() の確認用)"""
+    portfolio = trading.Portfolio(money=10 ** 12, tickers=(ticker,))
+    start = portfolio.money
+    held = False
+    for t, price in enumerate(values.tolist()):
+        last = t == len(values) - 1
+        if held and (exits[t] or last):
+            for _ in range(trading.LOT_SIZES.get(ticker, 1)):
+                portfolio.sell(ticker, price)
+            held = False
+        elif not held and entries[t] and not exits[t] and not last:
+            held = portfolio.buy(ticker, price) is not None
+    return portfolio.money - start
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='平均回帰戦略のバックテスト')
+    parser.add_argument('--replay', help='記録したフィクスチャのディレクトリ(mock_airoco.py --record)')
+    parser.add_argument('--synthetic', action='store_true', help='履歴キャッシュの代わりに合成データを使う(動作確認用)')
+    parser.add_argument('--days', type=int, default=7)
+    parser.add_argument('--tickers', nargs='+', default=list(trading.TICKERS), choices=trading.TICKERS)
+    parser.add_argument('--windows', type=float, nargs='+', default=DEFAULT_WINDOW_HOURS, help='平均を取る時間(時間)')
+    parser.add_argument('--top', type=int, default=10, help='損益の上位何件を表示するか')
+    parser.add_argument('--csv', help='全ての組み合わせの結果を書き出すCSV')
+    parser.add_argument('--check', action='store_true', help='上位の結果を trading.Portfolio で再生して照合する')
+    args = parser.parse_args()
+
+    try:
+        history = load_history(args.replay, args.days, synthetic=args.synthetic)
+    except ValueError as e:
+        parser.error(str(e))
+    print(f'{len(history["timestamp"])}行 ({args.days}日分)')
+    rows = []
+    for ticker in args.tickers:
+        values = np.ascontiguousarray(history[ticker])
+        start = time.perf_counter()
+        result = mean_reversion(values, args.windows, ticker=ticker)
+        elapsed = time.perf_counter() - start
+        count = len(result['profit'])
+        print(f'\n{ticker}: {count}通り {elapsed:.3f}秒 ({count / elapsed:,.0f}通り/秒)')
+        print(f'{"window_h":>9}{"drop":>7}{"rise":>7}{"trades":>8}{"profit":>12}')
+        for i in np.argsort(-result['profit'], kind='stable')[:args.top]:
+            print(f'{result["window_hours"][i]:>9g}{result["drop"][i]:>7.2f}{result["rise"][i]:>7.2f}'
+                  f'{result["trades"][i]:>8d}{result["profit"][i]:>12,.0f}')
+            if args.check:
+                ratio, ready = deviation(values, result['window_hours'][i])
+                expected = replay(values, ready & (ratio <= -result['drop'][i]), ready & (ratio >= result['rise'][i]), ticker)
+                if expected != result['profit'][i]:
+                    print(f'  不一致: Portfolioでの再生は {expected:,.0f}')
+        rows.extend(zip(itertools.repeat(ticker), *(result[name].tolist() for name in
+                                                     ('window_hours', 'drop', 'rise', 'trades', 'profit'))))
+
+    if args.csv:
+        with open(args.csv, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['ticker', 'window_hours', 'drop', 'rise', 'trades', 'profit'])
+            writer.writerows(rows)
+        print(f'\n{len(rows)}行を {args.csv} に書き出しました')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+# -*- coding: utf-8 -*-
+"""画面の無い環境(SDLのダミードライバ)で main.py の描画を動かし、1フレームの処理時間を段階ごとに計測する
+
+記録したデータ(mock_airoco.py のフィクスチャ)または合成データに対して、決まった操作
+(スクロール・表示期間の切り替え・グラフの切り替え・売買)を再生し、段階ごとのパーセンタイルを表示する。
+GPUの無いCIでも描画の遅れを数値で確認できる。
+使い方: python bench_frames.py [--replay DIR] [--days 7] [--script script.json] [--repeat 3] [--full-redraw] [--max-p95 MS]
+
+スクリプトはJSONの配列で、1要素が1つの操作:
+    {"idle": 30}                          30フレーム何もしない
+    {"key": "b"}                          キーを押す(pygame.key.key_code で解釈できる名前)
+    {"text": "12"}                        1文字ずつ入力する
+    {"click": "temp"}                     ボタン(co2/temp/humid/special)または [x, y] をクリック
+    {"drag": [1.0, 0.2], "frames": 60}    スクロールバーのハンドルを割合の位置までドラッグ
+"""
+import argparse
+import json
+import os
+import sys
+
+os.environ.setdefault('SDL_VIDEODRIVER', 'dummy')
+
+import numpy as np
+import pygame
+
+import airoco
+import main as app
+import mock_airoco
+import profiler
+
+
+DEFAULT_SCRIPT = [
+    {"idle": 10},
+    {"drag": [1.0, 0.4], "frames": 60},
+    {"drag": [0.4, 1.0], "frames": 60},
+    {"key": "down"}, {"idle": 5},
+    {"drag": [1.0, 0.5], "frames": 60},
+    {"key": "down"}, {"idle": 5},
+    {"drag": [0.5, 1.0], "frames": 60},
+    {"key": "up"}, {"key": "up"},
+    {"click": "temp"}, {"idle": 5},
+    {"key": "b"}, {"key": "b"}, {"key": "s"},
+    {"click": "humid"}, {"idle": 5},
+    {"click": "co2"},
+    {"key": "b"}, {"key": "s"},
+    {"click": "special"}, {"text": "3"}, {"key": "return"}, {"idle": 30},
+    {"key": "s"}, {"key": "s"}, {"key": "s"},
+    {"idle": 10},
+]
+
+BUTTONS = {
+    'co2': app.CO2_BUTTON_RECT,
+    'temp': app.TEMP_BUTTON_RECT,
+    'humid': app.HUMID_BUTTON_RECT,
+    'special': app.SPECIAL_BUTTON_RECT,
+}
+
+
+def load_series(replay: str = None, days: int = 7) -> np.ndarray:
+    """記録したフィクスチャ、無ければ合成データから (n, 4) の配列を作る"""
+    if replay:
+        fixtures = mock_airoco.FixtureStore(replay)
+        return airoco.load_days([fixtures.load(start_time) for start_time in fixtures.start_times()])
+    return airoco.load_days(mock_airoco.synthetic_days(days))
+
+
+def key_event(name: str) -> pygame.event.Event:
+    key = pygame.key.key_code(name)
+    return pygame.event.Event(pygame.KEYDOWN, key=key, unicode=name if len(name) == 1 else '', mod=0, scancode=0)
+
+
+def click_events(pos) -> list:
+    return [pygame.event.Event(pygame.MOUSEBUTTONDOWN, pos=pos, button=1),
+            pygame.event.Event(pygame.MOUSEBUTTONUP, pos=pos, button=1)]
+
+
+def play(script: list):
+    """スクリプトを1フレーム分ずつのイベントのリストにして返す(位置はその時点の画面の状態から決める)"""
+    for step in script:
+        if 'idle' in step:
+            for _ in range(step['idle']):
+                yield []
+        elif 'key' in step:
+            yield [key_event(step['key'])]
+        elif 'text' in step:
+            for char in step['text']:
+                yield [key_event(char)]
+        elif 'click' in step:
+            target = step['click']
+            pos = BUTTONS[target].center if isinstance(target, str) else tuple(target)
+            yield click_events(pos)
+        elif 'drag' in step:
+            start = app.handle_rect.center
+            yield [pygame.event.Event(pygame.MOUSEBUTTONDOWN, pos=start, button=1)]
+            bar = app.SCROLL_BAR_RECT
+            x0 = start[0]
+            x1 = bar.left + app.HANDLE_WIDTH / 2 + step['drag'][1] * (bar.width - app.HANDLE_WIDTH)
+            frames = step.get('frames', 30)
+            for i in range(1, frames + 1):
+                x = int(x0 + (x1 - x0) * i / frames)
+                yield [pygame.event.Event(pygame.MOUSEMOTION, pos=(x, start[1]), rel=(0, 0), buttons=(1, 0, 0))]
+            yield [pygame.event.Event(pygame.MOUSEBUTTONUP, pos=(x1, start[1]), button=1)]
+        else:
+            raise ValueError(f'unknown step: {step}')
+
+
+def run(script: list, full_redraw: bool = False) -> int:
+    """スクリプトを1回再生し、フレーム数を返す"""
+    frames = 0
+    for events in play(script):
+        if full_redraw:
+            app.layers.invalidate()
+        app.frame_profiler.start_frame()
+        app.run_frame(events)
+        app.frame_profiler.end_frame()
+        frames += 1
+    return frames
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='描画のフレーム時間ベンチマーク')
+    parser.add_argument('--replay', help='記録したフィクスチャのディレクトリ(mock_airoco.py --record)')
+    parser.add_argument('--days', type=int, default=7, help='合成データの日数')
+    parser.add_argument('--script', help='操作を記述したJSONファイル')
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--full-redraw', action='store_true', help='毎フレーム全ての層を描き直す(最悪値の計測)')
+    parser.add_argument('--max-p95', type=float, help='1フレームのp95(ミリ秒)がこれを超えたら終了コード1')
+    args = parser.parse_args()
+
+    script = DEFAULT_SCRIPT
+    if args.script:
+        with open(args.script, encoding='utf-8') as f:
+            script = json.load(f)
+
+    app.init_display(headless=True)
+    app.series.reset(load_series(args.replay, args.days))
+    app.backfill_exhausted = True   # ネットワークに取りに行かない
+    app.portfolio.money = 10 ** 7
+    app.frame_profiler = profiler.FrameProfiler(maxlen=None)   # 全フレームを残す
+
+    frames = sum(run(script, args.full_redraw) for _ in range(args.repeat))
+    print(f'{len(app.series)}行 / {frames}フレーム (full_redraw={args.full_redraw})')
+    print(app.frame_profiler.report())
+    print(f'文字キャッシュ: {app.text_cache.stats()}')
+    pygame.quit()
+
+    if args.max_p95 is not None:
+        p95 = app.frame_profiler.summary()['total']['p95']
+        if p95 > args.max_p95:
+            print(f'p95 {p95:.3f} ms > {args.max_p95} ms')
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+# -*- coding: utf-8 -*-
+"""mock_airoco.py を相手に、起動時の取得と差分更新の時間を計測するベンチマーク
+
+ネットワーク無しで何度でも同じ条件で再現できる。
+使い方: python bench_ingest.py [--latency 0.2] [--sensors 8] [--error-rate 0] [--replay DIR]
+"""
+import argparse
+import csv
+import statistics
+import tempfile
+import time
+
+import numpy as np
+import requests
+
+import airoco
+import history_cache
+import mock_airoco
+
+
+def legacy_cold_start(now: int) -> np.ndarray:
+    """変更前のmain.pyと同じ取得処理(7回の逐次requests.get + csv.reader)"""
+    data = []
+    for i in range(7, 0, -1):
+        tt = now - 3600 * 24 * i
+        try:
+            res = requests.get(f'{airoco.API_URL}&startDate={tt}')
+            res.raise_for_status()
+            for row in csv.reader(res.text.strip().splitlines()):
+                if row[1] == airoco.SENSOR_NAME:
+                    data.append(list(map(float, row[3:7])))
+        except requests.exceptions.RequestException as e:
+            print(f"API request failed: {e}")
+    return np.array(data)
+
+
+def cached_start(cache: history_cache.HistoryCache, now: int) -> np.ndarray:
+    """キャッシュを読み込み、最新行以降の差分だけを取得する(main.get_airoco_dataと同じ流れ)"""
+    cached = cache.load()
+    start_time = max(now - airoco.DAY_SECONDS * 7, int(cached['timestamp'][-1]))
+    fetched = airoco.fetch_since(start_time, now)
+    cache.append(fetched)
+    return fetched
+
+
+def measure(label: str, func, repeat: int) -> None:
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = func()
+        times.append(time.perf_counter() - start)
+    print(f'{label:<28}: median {statistics.median(times) * 1000:8.1f} ms  '
+          f'max {max(times) * 1000:8.1f} ms  ({len(rows)}行)')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='取り込み・起動ベンチマーク')
+    parser.add_argument('--latency', type=float, default=0.2, help='1リクエストあたりの遅延(秒)')
+    parser.add_argument('--sensors', type=int, default=8)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--replay', help='記録したフィクスチャのディレクトリ')
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    server = mock_airoco.MockAirocoServer(port=0, sensors=args.sensors, latency=args.latency,
+                                          error_rate=args.error_rate, replay=args.replay).start_background()
+    airoco.API_URL = server.url
+
+    # 記録を再生する場合は記録時刻を、そうでなければ現在時刻を基準にする
+    starts = server.fixtures.start_times() if server.fixtures else []
+    now = starts[-1] + airoco.DAY_SECONDS if starts else int(time.time())
+
+    print(f'latency={args.latency}s sensors={args.sensors} error_rate={args.error_rate}')
+    measure('legacy cold start (7 seq)', lambda: legacy_cold_start(now), args.repeat)
+    measure('parallel cold start', lambda: airoco.fetch_past_days(7, now), args.repeat)
+    measure('incremental update', lambda: airoco.fetch_days([now - airoco.DAY_SECONDS]), args.repeat)
+
+    with tempfile.TemporaryDirectory() as root:
+        cache = history_cache.HistoryCache(airoco.SENSOR_NAME, root=root)
+        cache.append(airoco.fetch_past_days(7, now - 3600))   # 1時間前に終了した想定
+        measure('warm start from cache', lambda: cached_start(cache, now), args.repeat)
+
+    print(f'requests served: {server.request_count}')
+    server.stop()
+
+
+if __name__ == '__main__':
+    main()
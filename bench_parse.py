@@ -0,0 +1,78 @@
+# -*- coding: utf-8 -*-
+"""day-csvのパース速度を、旧来の1行ずつの処理と一括パースで比較するベンチマーク
+
+使い方: python bench_parse.py [行数] [センサー数]
+"""
+import csv
+import random
+import sys
+import time
+
+import numpy as np
+
+import airoco
+
+
+def make_payload(rows: int = 100000, sensors: int = 8, seed: int = 0) -> str:
+    """複数センサーが混在した合成day-csvを生成する"""
+    rng = random.Random(seed)
+    names = [airoco.SENSOR_NAME] + [f'Ｒ３ー{400 + i:03d}' for i in range(2, sensors + 1)]
+    start = 1700000000
+    lines = []
+    for i in range(rows):
+        lines.append(','.join([
+            '2023/11/14 22:13',
+            names[i % sensors],
+            'CgETViZ2',
+            str(rng.randint(400, 1500)),
+            f'{rng.uniform(15, 30):.1f}',
+            f'{rng.uniform(30, 70):.1f}',
+            str(start + (i // sensors) * 300),
+        ]))
+    return '\n'.join(lines)
+
+
+def parse_legacy(text: str, sensor: str = airoco.SENSOR_NAME) -> list:
+    """変更前のmain.pyと同じ処理(csv.reader + 行ごとの比較 + np.array().tolist())"""
+    data = []
+    for row in csv.reader(text.strip().splitlines()):
+        if row[1] == sensor:
+            data.append(list(map(float, row[3:7])))
+    data = np.array(data)
+    return [data[:, 3].tolist(), data[:, 0].tolist(), data[:, 1].tolist(), data[:, 2].tolist()]
+
+
+def best_of(func, text: str, repeat: int = 5) -> float:
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func(text)
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main() -> None:
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 100000
+    sensors = int(sys.argv[2]) if len(sys.argv) > 2 else 8
+    text = make_payload(rows, sensors)
+
+    # 結果が一致することを確認してから計測する
+    legacy = parse_legacy(text)
+    fast = airoco.parse_day_csv(text)
+    assert np.array_equal(np.array(legacy[1]), fast[:, 0])
+    assert np.array_equal(np.array(legacy[0]), fast[:, 3])
+
+    per_sensor = airoco.parse_all_sensors(text)
+    assert np.array_equal(per_sensor[airoco.SENSOR_NAME], fast)
+
+    legacy_time = best_of(parse_legacy, text)
+    fast_time = best_of(airoco.parse_day_csv, text)
+    all_time = best_of(airoco.parse_all_sensors, text)
+    print(f'{rows}行 / {sensors}センサー ({len(fast)}行が対象)')
+    print(f'legacy    : {legacy_time * 1000:8.2f} ms')
+    print(f'vectorized: {fast_time * 1000:8.2f} ms  (x{legacy_time / fast_time:.2f})')
+    print(f'all rooms : {all_time * 1000:8.2f} ms  ({len(per_sensor)}センサー分、legacyなら{legacy_time * len(per_sensor) * 1000:.0f} ms相当)')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""trading.Portfolio の注文処理の速度を計測するベンチマーク(pygame不要)
+
+使い方: python bench_trading.py [--orders 1000000] [--seed 0] [--tickers 300]
+"""
+import argparse
+import time
+
+import numpy as np
+
+import trading
+
+
+def make_orders(count: int, seed: int = 0) -> list:
+    """買い・売りが半々で、銘柄と価格がランダムな注文の列"""
+    rng = np.random.default_rng(seed)
+    sides = np.where(rng.random(count) < 0.5, "buy", "sell").tolist()
+    tickers = rng.choice(trading.TICKERS, count).tolist()
+    base = {"co2": 700.0, "temp": 25.0, "humid": 50.0}
+    prices = [base[t] * f for t, f in zip(tickers, (1 + rng.normal(0, 0.05, count)).tolist())]
+    return list(zip(sides, tickers, prices))
+
+
+def bench_valuation(count: int, updates: int = 100_000, seed: int = 0) -> None:
+    """count銘柄を持つPortfolioで、価格の更新1回ごとの差分評価と全銘柄の再計算を比べる"""
+    rng = np.random.default_rng(seed)
+    tickers = tuple(f"t{i}" for i in range(count))
+    portfolio = trading.Portfolio(money=10 ** 12, tickers=tickers)
+    for ticker in tickers:
+        portfolio.buy(ticker, 100.0)
+    targets = rng.choice(tickers, updates).tolist()
+    prices = (100 * (1 + rng.normal(0, 0.05, updates))).tolist()
+
+    start = time.perf_counter()
+    for ticker, price in zip(targets, prices):
+        portfolio.update_price(ticker, price)
+    incremental = (time.perf_counter() - start) / updates
+    total = portfolio.total_profit
+
+    start = time.perf_counter()
+    repeat = max(1, updates // count)
+    for _ in range(repeat):
+        portfolio.revalue()
+    full = (time.perf_counter() - start) / repeat
+    print(f'{count}銘柄: 差分評価 {incremental * 1e6:.2f}us/回, 全銘柄の再計算 {full * 1e6:.1f}us/回'
+          f' (合計の誤差 {abs(total - portfolio.total_profit):.2e})')
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='注文処理のベンチマーク')
+    parser.add_argument('--orders', type=int, default=1_000_000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--tickers', type=int, default=300, help='評価のベンチマークに使う銘柄数')
+    args = parser.parse_args()
+
+    orders = make_orders(args.orders, args.seed)
+    portfolio = trading.Portfolio(money=10 ** 9)
+    start = time.perf_counter()
+    fills = portfolio.execute(orders)
+    elapsed = time.perf_counter() - start
+    print(f'{len(orders)}件の注文 / {len(fills)}件約定: {elapsed:.3f}秒 ({len(orders) / elapsed / 1e6:.2f}M件/秒)')
+    print(f'所持金: {portfolio.money:,} / 損益合計: {portfolio.total_profit:,.0f}')
+    bench_valuation(args.tickers, seed=args.seed)
+
+
+if __name__ == '__main__':
+    main()
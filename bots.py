@@ -0,0 +1,80 @@
+# -*- coding: utf-8 -*-
+"""アリーナ(arena.py)で戦わせるボットの例
+
+ボットは seed(とキーワード引数)を受け取ってポリシーを返す関数で、ポリシーは
+policy(price_desk, portfolio) -> 注文のリスト を満たす呼び出し可能なオブジェクト。
+price_desk は main.py と同じ {銘柄: {"now_price": 現在価格, "last_price": 前回価格}} の読み取り専用のビュー、
+portfolio は trading.Portfolio の money / stocks / special_state をその時点で写したもの(arena.account_view)で、
+書き換えても実際の所持金や保有株には影響しない。
+注文は ("buy", 銘柄) / ("sell", 銘柄) / ("special", 銘柄, 株数) のタプル。
+"""
+import random
+
+import trading
+
+
+def hold(seed: int = 0):
+    """最初に買えるだけ1銘柄を買って持ち続ける"""
+    ticker = random.Random(seed).choice(trading.TICKERS)
+
+    def policy(price_desk, portfolio):
+        price = price_desk[ticker]["now_price"]
+        if price > 0 and portfolio.money >= price * trading.LOT_SIZES[ticker]:
+            return [("buy", ticker)]
+        return []
+    return policy
+
+
+def random_trader(seed: int = 0, rate: float = 0.05):
+    """毎回rateの確率でランダムに売買する"""
+    rng = random.Random(seed)
+
+    def policy(price_desk, portfolio):
+        if rng.random() >= rate:
+            return []
+        return [(rng.choice(("buy", "sell")), rng.choice(trading.TICKERS))]
+    return policy
+
+
+def mean_reversion(seed: int = 0, alpha: float = None, drop: float = None, rise: float = None):
+    """指数移動平均よりdrop下がったら買い、rise上がったら全て売る(省略したパラメータはseedから決める)"""
+    rng = random.Random(seed)
+    alpha = alpha or rng.uniform(0.005, 0.1)
+    drop = drop or rng.uniform(0.005, 0.1)
+    rise = rise or rng.uniform(0.0, 0.1)
+    average = {}
+
+    def policy(price_desk, portfolio):
+        orders = []
+        for ticker, desk in price_desk.items():
+            price = desk["now_price"]
+            if price <= 0:
+                continue
+            mean = average[ticker] = average.get(ticker, price) * (1 - alpha) + price * alpha
+            if price < mean * (1 - drop):
+                orders.append(("buy", ticker))
+            elif price > mean * (1 + rise):
+                orders.extend([("sell", ticker)] * portfolio.stocks[ticker]["stock"])
+        return orders
+    return policy
+
+
+def special_gambler(seed: int = 0, quantity: int = None, target: float = None):
+    """価格が上がった銘柄を短時間モードで買い、交渉価格が購入価格のtarget倍を超えたら売り切る"""
+    rng = random.Random(seed)
+    quantity = quantity or rng.randint(1, 5)
+    target = target or rng.uniform(1.12, 1.5)
+    bought = {}
+
+    def policy(price_desk, portfolio):
+        orders = []
+        for ticker, desk in price_desk.items():
+            position = portfolio.stocks[ticker]
+            if portfolio.special_state[ticker] == trading.SPECIAL_ACTIVE:
+                if position["negotiation_price"] * trading.SELL_RATE > bought[ticker] * target:
+                    orders.extend([("sell", ticker)] * position["special_stocks"])
+            elif 0 < desk["last_price"] < desk["now_price"] and portfolio.money >= desk["now_price"] * quantity:
+                bought[ticker] = desk["now_price"]
+                orders.append(("special", ticker, quantity))
+        return orders
+    return policy
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+import time
+from collections import OrderedDict
+
+import numpy as np
+
+
+# X軸の目盛り間隔の候補(秒)。表示範囲に収まる目盛りの数が上限以下になる最小の間隔を使う
+TICK_STEPS = (300, 600, 900, 1800, 3600, 2 * 3600, 3 * 3600, 6 * 3600, 12 * 3600,
+              86400, 2 * 86400, 7 * 86400)
+
+def _utc_offsets(timestamps: np.ndarray) -> np.ndarray:
+    """各タイムスタンプのローカル時刻とのずれ(秒)。夏時間の切り替えを跨がなければ1回の計算で済ませる"""
+    first = time.localtime(timestamps[0]).tm_gmtoff
+    last = time.localtime(timestamps[-1]).tm_gmtoff
+    if first == last:
+        return np.full(len(timestamps), first, dtype=np.int64)
+    return np.array([time.localtime(ts).tm_gmtoff for ts in timestamps.tolist()], dtype=np.int64)
+
+
+def format_tick_labels(timestamps: np.ndarray) -> list:
+    """エポック秒の配列を "%m/%d %H:%M" 形式の文字列にまとめて変換する(datetimeを経由しない)"""
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    n = len(timestamps)
+    if n == 0:
+        return []
+
+    local = (timestamps.astype(np.int64) + _utc_offsets(timestamps)).astype('datetime64[s]')
+    iso = np.datetime_as_string(local, unit='m').astype('U16')     # 'YYYY-MM-DDTHH:MM'
+    chars = iso.view('U1').reshape(n, 16)
+
+    out = np.empty((n, 11), dtype='U1')
+    out[:, 0:2] = chars[:, 5:7]      # 月
+    out[:, 2] = '/'
+    out[:, 3:5] = chars[:, 8:10]     # 日
+    out[:, 5] = ' '
+    out[:, 6:11] = chars[:, 11:16]   # 時:分
+    return out.view('U11').ravel().tolist()
+
+
+def time_ticks(timestamps: np.ndarray, max_ticks: int = 5) -> tuple:
+    """表示範囲の目盛りを、きりの良い時刻(正時・0時など、ローカル時刻基準)に揃えて求める
+
+    (位置, 時刻) を返す。位置はtimestampsの先頭からの相対インデックス(小数)。
+    目盛りの時刻はスクロールしても変わらないので、ラベルの描画結果を使い回せる。
+    """
+    timestamps = np.asarray(timestamps, dtype=np.float64)
+    if len(timestamps) < 2:
+        return np.empty(0), np.empty(0)
+    first, last = float(timestamps[0]), float(timestamps[-1])
+    span = last - first
+    step = next((s for s in TICK_STEPS if span / s <= max_ticks), None)
+    if step is None:  # 候補より長い範囲は最大の間隔の倍数にする
+        step = TICK_STEPS[-1] * int(np.ceil(span / (TICK_STEPS[-1] * max_ticks)))
+
+    offset = time.localtime(first).tm_gmtoff
+    start = np.ceil((first + offset) / step) * step - offset
+    ticks = np.arange(start, last + 1, step)
+    # 欠測区間があっても正しい位置に置けるよう、時刻からインデックスを線形補間する
+    positions = np.interp(ticks, timestamps, np.arange(len(timestamps), dtype=np.float64))
+    return positions, ticks
+
+
+class Geometry:
+    """グラフ1枚分の画面座標と目盛りの計算結果"""
+    __slots__ = ('points', 'min_value', 'value_range', 'scale_x', 'scale_y', 'baseline')
+
+    def __init__(self, points, min_value, value_range, scale_x, scale_y, baseline):
+        self.points = points            # pygame.draw.lines に渡す [(x, y), ...]
+        self.min_value = min_value
+        self.value_range = value_range
+        self.scale_x = scale_x          # 1件あたりのX方向の幅(px)
+        self.scale_y = scale_y          # 値1あたりのY方向の高さ(px)
+        self.baseline = baseline        # min_valueを描くY座標
+
+    def y(self, value: float) -> float:
+        return self.baseline - (value - self.min_value) * self.scale_y
+
+
+def compute_geometry(positions: np.ndarray, values: np.ndarray, count: int, rect: tuple, padding: int = 20) -> Geometry:
+    """間引き済みの (位置, 値) から折れ線の画面座標を求める
+
+    positionsは表示範囲の先頭からの相対インデックス、countは表示件数、rectは (left, top, width, height)。
+    点の数はグラフの横幅で頭打ちになっているので、表示件数によらず計算量は一定。
+    """
+    left, top, width, height = rect
+    min_value = float(values.min())
+    value_range = float(values.max()) - min_value
+    if value_range == 0:
+        value_range = 1.0
+
+    scale_x = width / max(1, count - 1)
+    scale_y = (height - padding * 2) / value_range
+    baseline = top + height - padding
+    xs = left + positions * scale_x
+    ys = baseline - (values - min_value) * scale_y
+    points = np.column_stack([xs, ys]).tolist() if len(xs) > 1 else []
+    return Geometry(points, min_value, value_range, scale_x, scale_y, baseline)
+
+
+class LRUCache:
+    """キーごとに計算結果を覚えておく(古いものから捨てる)"""
+
+    def __init__(self, maxsize: int = 256):
+        self.maxsize = maxsize
+        self._items = OrderedDict()
+
+    def get(self, key, build):
+        """keyに対応する値を返す。無ければbuild()で作って覚える"""
+        if key in self._items:
+            self._items.move_to_end(key)
+            return self._items[key]
+        value = build()
+        self._items[key] = value
+        if len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+        return value
@@ -0,0 +1,214 @@
+# -*- coding: utf-8 -*-
+import os
+import shutil
+import time
+
+import numpy as np
+
+
+CACHE_DIR = 'airoco_cache'      # キャッシュの保存先ディレクトリ
+RETENTION_DAYS = 30             # 保持する日数(これより古い行はコンパクション時に削除)
+COMPACT_SLACK_DAYS = 1          # 保持期間をこの日数だけ超えたらコンパクションする
+
+# 列名と型(リトルエンディアンのfloat64、ヘッダなしの生バイナリ)
+COLUMNS = ('co2', 'temp', 'humid', 'timestamp')
+DTYPE = np.dtype('<f8')
+MANIFEST = 'CURRENT'            # 現在の世代ディレクトリ名と確定済みの行数を書いたファイル
+LEGACY_GENERATION = '.'         # 世代ディレクトリを使う前の形式(列ファイルがセンサーのディレクトリ直下にある)
+
+
+class HistoryCache:
+    """センサー履歴を列ごとのバイナリファイルに保存し、起動時にメモリマップで読み込む
+
+    列ファイルは世代ディレクトリ(gen-N)に置き、どの世代の何行目までが有効かをMANIFESTに書く。
+    追記は列ファイルに書き足してからMANIFESTの行数を更新し、コンパクションや間への挿入は新しい世代に
+    全列を書いてからMANIFESTを切り替える。MANIFESTの置き換えはos.replace1回なので、
+    途中で落ちても全列が古い状態か新しい状態のどちらかになる。
+    """
+
+    def __init__(self, sensor: str, root: str = CACHE_DIR, retention_days: float = RETENTION_DAYS):
+        self.path = os.path.join(root, sensor)
+        self.retention = retention_days * 3600 * 24
+        os.makedirs(self.path, exist_ok=True)
+        if self._read_manifest() is None:
+            self._adopt_legacy()
+
+    def _adopt_legacy(self) -> None:
+        """MANIFESTの無い古い形式のキャッシュは、揃っている行数までを確定済みとして引き継ぐ"""
+        sizes = [self._size(LEGACY_GENERATION, column) for column in COLUMNS]
+        if min(sizes) > 0:
+            self._write_manifest(LEGACY_GENERATION, min(sizes))
+        else:
+            os.makedirs(os.path.join(self.path, 'gen-0'), exist_ok=True)
+            self._write_manifest('gen-0', 0)
+
+    def _read_manifest(self):
+        try:
+            with open(os.path.join(self.path, MANIFEST), encoding='utf-8') as f:
+                generation, length = f.read().split()
+            return generation, int(length)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def _write_manifest(self, generation: str, length: int) -> None:
+        file = os.path.join(self.path, MANIFEST)
+        with open(file + '.tmp', 'w', encoding='utf-8') as f:
+            f.write(f'{generation} {length}\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(file + '.tmp', file)
+
+    def _state(self) -> tuple:
+        """(現在の世代, 確定済みの行数)"""
+        state = self._read_manifest()
+        if state is None:   # 別のプロセスで消された場合など
+            self._adopt_legacy()
+            state = self._read_manifest()
+        return state
+
+    def _file(self, column: str, generation: str = None) -> str:
+        generation = generation or self._state()[0]
+        return os.path.join(self.path, generation, f'{column}.f8')
+
+    def _size(self, generation: str, column: str) -> int:
+        file = self._file(column, generation)
+        return os.path.getsize(file) // DTYPE.itemsize if os.path.exists(file) else 0
+
+    def _length(self) -> int:
+        """確定済みの行数。列ファイルがそれより短ければ(壊れている)揃っている行数に切り詰める"""
+        generation, length = self._state()
+        available = min(self._size(generation, column) for column in COLUMNS)
+        if available < length:
+            print(f'[WARN] 履歴キャッシュの列の長さが揃っていません({available} < {length})。{available}行までを使います。')
+            self._write_manifest(generation, available)
+            return available
+        return length
+
+    def load(self) -> dict:
+        """各列を読み取り専用のメモリマップで返す"""
+        self.compact_if_needed()
+        return self._map()
+
+    def compact_if_needed(self, now: float = None) -> int:
+        """最古の行が保持期間をCOMPACT_SLACK_DAYS以上超えていればコンパクションする"""
+        now = time.time() if now is None else now
+        if self._length() == 0:
+            return 0
+        oldest = np.fromfile(self._file('timestamp'), dtype=DTYPE, count=1)[0]
+        if oldest < now - self.retention - COMPACT_SLACK_DAYS * 3600 * 24:
+            return self.compact(now)
+        return 0
+
+    def _map(self) -> dict:
+        length = self._length()
+        if length == 0:
+            return {column: np.empty(0, dtype=DTYPE) for column in COLUMNS}
+        return {
+            column: np.memmap(self._file(column), dtype=DTYPE, mode='r', shape=(length,))
+            for column in COLUMNS
+        }
+
+    def last_timestamp(self):
+        """キャッシュ済みの最新タイムスタンプ。空ならNone"""
+        length = self._length()
+        if length == 0:
+            return None
+        return float(np.memmap(self._file('timestamp'), dtype=DTYPE, mode='r', shape=(length,))[-1])
+
+    def append(self, rows) -> int:
+        """[CO2濃度, 気温, 湿度, タイムスタンプ] の行のうち、キャッシュより新しいものだけ追記する"""
+        if len(rows) == 0:
+            return 0
+        data = np.asarray(rows, dtype=DTYPE).reshape(-1, len(COLUMNS))
+        last = self.last_timestamp()
+        if last is not None:
+            data = data[data[:, 3] > last]
+        if len(data) == 0:
+            return 0
+
+        # 全列を書き足してからMANIFESTの行数を更新する(途中で落ちても書きかけの行は使われない)
+        length = self._length()
+        generation = self._state()[0]
+        for i, column in enumerate(COLUMNS):
+            file = self._file(column, generation)
+            with open(file, 'r+b' if os.path.exists(file) else 'wb') as f:
+                f.seek(length * DTYPE.itemsize)
+                f.truncate()
+                f.write(data[:, i].tobytes())
+        self._write_manifest(generation, length + len(data))
+
+        # 起動しっぱなしの端末でも肥大化しないよう、追記のたびに保持期間を確認する
+        self.compact_if_needed()
+        return len(data)
+
+    def merge(self, rows, now: float = None) -> int:
+        """行を時刻で突き合わせて保存し、追記・挿入・訂正した行数を返す
+
+        最新行より新しい行だけなら追記する。間に入る行(取り直した日や遡り読み込み)や値の変わった行
+        (遅れて届いた訂正)があれば、新しい世代に全体を書き直す。同じ時刻の行は後から来た方を優先し
+        (SeriesStore.merge と同じ)、保持期間より古い行は保存しない。
+        """
+        now = time.time() if now is None else now
+        data = np.asarray(rows, dtype=DTYPE).reshape(-1, len(COLUMNS))
+        data = data[data[:, 3] >= now - self.retention]
+        if len(data) == 0:
+            return 0
+        data = data[np.argsort(data[:, 3], kind='stable')]
+        data = data[np.r_[data[1:, 3] != data[:-1, 3], True]]
+        last = self.last_timestamp()
+        if last is None or data[0, 3] > last:
+            return self.append(data)
+
+        # 重なった行だけをメモリマップから読んで比べ、何も変わらなければ書き直さない(定期更新はほぼこれ)
+        cached = self._map()
+        newer = data[:, 3] > last
+        middle = data[~newer]
+        pos = np.searchsorted(cached['timestamp'], middle[:, 3])   # middleは最新行以前なので範囲内に収まる
+        stored = np.column_stack([cached[column][pos] for column in COLUMNS])
+        exact = stored[:, 3] == middle[:, 3]
+        changed = exact & np.any(stored != middle, axis=1)
+        if not changed.any() and exact.all():
+            return self.append(data[newer])
+        table = self._read()
+        table[pos[changed]] = middle[changed]
+        table = np.insert(table, pos[~exact], middle[~exact], axis=0)
+        self._write_generation(np.concatenate([table, data[newer]]))
+        return int(changed.sum() + (~exact).sum() + newer.sum())
+
+    def _read(self) -> np.ndarray:
+        """確定済みの行を (n, 4) の配列として読み込む"""
+        length = self._length()
+        return np.column_stack([np.fromfile(self._file(column), dtype=DTYPE, count=length) for column in COLUMNS])
+
+    def compact(self, now: float = None) -> int:
+        """保持期間より古い行を削除して書き直す。削除した行数を返す"""
+        now = time.time() if now is None else now
+        if self._length() == 0:
+            return 0
+        table = self._read()
+        keep = table[:, 3] >= now - self.retention
+        self._write_generation(table[keep])
+        return int(len(table) - keep.sum())
+
+    def _write_generation(self, table: np.ndarray) -> None:
+        """(n, 4) の配列を新しい世代に全列書き、MANIFESTの切り替え1回で全列をまとめて置き換える"""
+        old = self._state()[0]
+        number = int(old[4:]) + 1 if old.startswith('gen-') else 1
+        generation = f'gen-{number}'
+        shutil.rmtree(os.path.join(self.path, generation), ignore_errors=True)   # 前回の書きかけ
+        os.makedirs(os.path.join(self.path, generation))
+        for i, column in enumerate(COLUMNS):
+            with open(self._file(column, generation), 'wb') as f:
+                f.write(np.ascontiguousarray(table[:, i], dtype=DTYPE).tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+        self._write_manifest(generation, len(table))
+
+        # 古い世代を消す(消す前に落ちても次の世代の書き込みには影響しない)
+        if old == LEGACY_GENERATION:
+            for column in COLUMNS:
+                file = self._file(column, old)
+                if os.path.exists(file):
+                    os.remove(file)
+        else:
+            shutil.rmtree(os.path.join(self.path, old), ignore_errors=True)
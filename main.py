@@ -3,13 +3,17 @@ import asyncio
 import pygame
 import sys
 import time
-import csv
-import requests
 import datetime
 import numpy as np
-import math
 from typing import Tuple
-import constants
+import airoco
+import chart
+import history_cache
+import profiler
+import render
+import scheduler
+import series_store
+import trading
 from concurrent.futures import ThreadPoolExecutor
 import re
 import client
@@ -19,88 +23,183 @@ import os
 USER_FILE = 'user_name.txt'
 API_SERVER_URL = 'http://localhost:5000'
 
+HISTORY_DAYS = 7          # 起動時に表示する日数
+histories = {}            # センサー名ごとのローカルの履歴キャッシュ(open_history() で開く。importしただけではディレクトリを作らない)
+
+def open_history(sensor=airoco.SENSOR_NAME):
+    """センサーの履歴キャッシュを初回だけ開いて返す"""
+    if sensor not in histories:
+        histories[sensor] = history_cache.HistoryCache(sensor)
+    return histories[sensor]
+
+def load_cached(sensor=airoco.SENSOR_NAME):
+    """センサーの履歴キャッシュを (n, 4) の配列として読み込む"""
+    cached = open_history(sensor).load()
+    return np.column_stack([np.array(cached[column]) for column in history_cache.COLUMNS])  # メモリマップを手元にコピー
+
+def open_series(sensor):
+    """センサー(部屋)の時系列を返す。初めて見るセンサーはキャッシュから作る"""
+    if sensor not in sensor_series:
+        store = series_store.SeriesStore(capacity=series.capacity)
+        store.reset(load_cached(sensor))
+        sensor_series[sensor] = store
+    return sensor_series[sensor]
+
+missing_days = set()      # 取得に失敗した日チャンクの開始時刻(次の更新でまとめて取り直す)
+
+def ingest(start_times, retry_missing=True):
+    """日チャンクを1回ずつだけ取得し、全センサー(部屋)分を sensor_series と履歴キャッシュに取り込む
+
+    表示中のセンサー(SENSOR_NAME)の merge の件数を返す。retry_missing=True の場合は前回までに失敗した日も
+    一緒に取り直し、今回失敗した日は missing_days に残す。
+    1つも取得できなければ airoco.FetchError を送出する(取得失敗はスケジューラへ伝える)。
+    """
+    if retry_missing:
+        oldest = int(time.time()) - airoco.DAY_SECONDS * (HISTORY_DAYS + 1)   # 表示期間より前の日は諦める
+        start_times = sorted(set(start_times) | {t for t in missing_days if t >= oldest})
+    failed = []
+    per_sensor = airoco.fetch_days_by_sensor(start_times, strict=True, failed=failed)
+    if retry_missing:
+        missing_days.clear()
+        missing_days.update(failed)
+        if failed:
+            print(f"[{datetime.datetime.now().strftime('%H:%M:%S')}] {len(failed)}日分のチャンクを取得できませんでした(次の更新で取り直します)")
+
+    stats = {'appended': 0, 'prepended': 0, 'inserted': 0, 'corrected': 0}
+    for sensor, rows in per_sensor.items():
+        # 時刻で突き合わせて取り込む(重なった行は取得分を優先)。遅れて届いた行・取り直した日もキャッシュに反映する
+        result = open_series(sensor).merge(rows)
+        open_history(sensor).merge(rows)
+        if sensor == airoco.SENSOR_NAME:
+            stats = result
+    return stats
+
 # 過去7日間のCO2濃度データをAPIから取得する関数 get_past_7_days_co2
 def get_airoco_data():
-    global timestamps, co2_values, temp_values, humid_values
-    curr_time = int(time.time())
-    data = []
-    
-    # 過去7日間のデータを日ごとに取得
-    for i in range(7, 0, -1):
-        tt = curr_time - 3600 * 24 * i
-        try:
-            res = requests.get(f'{constants.API_KEY}&startDate={tt}')
-            res.raise_for_status()  # HTTPエラーがあれば例外を発生
-            raw_data = csv.reader(res.text.strip().splitlines())
-
-            for row in raw_data:
-                if row[1] == 'Ｒ３ー４０１':
-                    data.append(list(map(float, row[3:7])))  # CO2濃度, 気温, 湿度, タイムスタンプ
-        except requests.exceptions.RequestException as e:
-            print(f"API request failed: {e}")
-            continue
-
-    if not data:
+    # キャッシュを読み込み、前回終了時から現在までの差分だけを並列取得(タイムスタンプ順)
+    cached = load_cached()
+    if len(series) == 0:
+        series.reset(cached)  # CO2濃度, 気温, 湿度, タイムスタンプ(取得に失敗してもキャッシュは表示する)
+    now = int(time.time())
+    oldest = now - airoco.DAY_SECONDS * HISTORY_DAYS
+    start_times = airoco.day_starts(max(oldest, cached[-1, 3]) if len(cached) else oldest, now)
+    # 表示期間内のキャッシュの抜け(前回取得できなかった日・センサー停止)も一緒に取り直す
+    if len(cached):
+        holes = series_store.find_gaps(np.concatenate([[oldest], cached[:, 3]]))
+        for begin, end in holes[holes[:, 1] > oldest].tolist():
+            start_times += airoco.day_starts(max(begin, oldest), end)
+    stats = ingest(start_times)
+    print(f"キャッシュ: {len(cached)}件 / 取り込み: {sum(stats.values())}件 / センサー: {len(sensor_series)}台")
+
+    if len(series) == 0:
         print("This sensor is not connected or no data available.")
 
-    data = np.array(data)
-
-    timestamps = [datetime.datetime.fromtimestamp(ts) for ts in data[:, 3]]
-    co2_values = data[:, 0].tolist()  # CO2濃度
-    temp_values = data[:, 1].tolist()  # 気温
-    humid_values = data[:, 2].tolist()  # 湿度
+# 最新1日分のチャンクだけを取得し、既存のデータに取り込む関数
+def get_airoco_update():
+    """差分更新。追記した件数を返す"""
+    curr_time = int(time.time())
+    last_timestamp = series.last('timestamp')
+
+    # 未取得の場合は起動時と同じ取得に切り替える
+    if last_timestamp is None:
+        get_airoco_data()
+        return len(series)
+
+    # 1日以上空いた場合は最新行から現在までの日チャンクを(最大HISTORY_DAYS日分)取得する
+    # 取得失敗はスケジューラへ伝える(バックオフのため)
+    if curr_time - last_timestamp >= airoco.DAY_SECONDS:
+        start_time = max(last_timestamp, curr_time - airoco.DAY_SECONDS * HISTORY_DAYS)
+        stats = ingest(airoco.day_starts(start_time, curr_time))
+    else:
+        # 1日分のチャンクは既存データと重なるので、重複は捨てて訂正・抜けていた行だけ反映する
+        stats = ingest([curr_time - airoco.DAY_SECONDS])
+    if stats['inserted'] or stats['corrected']:
+        print(f"遅れて届いたデータ: 挿入{stats['inserted']}件 / 訂正{stats['corrected']}件")
+    return stats['appended']
+
+# 表示中の最古データより1日前のチャンクを取得し、先頭に追加する関数(左スクロール時の遡り読み込み)
+def backfill_history():
+    """遡り読み込み。追加した件数を返す"""
+    global backfill_pending, backfill_exhausted, backfill_empty_days, backfill_retry_at
+    try:
+        oldest = series.first('timestamp')
+        if oldest is None:
+            return 0
+        # センサーが止まっていた日は飛ばして、さらに前の日を取りに行く
+        start_time = int(oldest) - airoco.DAY_SECONDS * (backfill_empty_days + 1)
+        try:
+            # 失敗した日の取り直し(missing_days)とは混ぜない(失敗をデータの無い日と区別するため)
+            added = ingest([start_time], retry_missing=False)['prepended']
+        except airoco.FetchError as e:
+            # 通信の失敗ではデータが無いとみなさず、少し待ってから再試行する
+            backfill_retry_at = time.time() + scheduler.RETRY_INTERVAL
+            print(f"[{datetime.datetime.now().strftime('%H:%M:%S')}] 過去データの取得に失敗しました: {e}")
+            return 0
+        if added:
+            backfill_empty_days = 0
+        elif len(series) >= series.capacity:
+            backfill_exhausted = True   # 保持できる最大件数に達したら以降は遡らない
+        else:
+            backfill_empty_days += 1
+            if backfill_empty_days >= BACKFILL_MAX_EMPTY_DAYS:
+                backfill_exhausted = True   # データの無い日が続いたらそれ以上古いデータは無いとみなす
+        print(f"[{datetime.datetime.now().strftime('%H:%M:%S')}] 過去データを{added}件読み込みました。")
+        return added
+    finally:
+        backfill_pending = False
+        pygame.event.post(pygame.event.Event(BACKFILL_DONE_EVENT))  # 待機中の描画ループを起こす
 
 # 起動時に必要なデータを非同期で取得する（描画は即開始）
 def init_async_data():
-    global co2_values, temp_values, humid_values
-    global money, stocks
-
     update_data(first=True)  # これで select_code にデータが入る
 
-    money = client.get_user_money(user_name)
-    backuped_stocks = client.get_user_stocks(user_name)
-    for stock_type in ["co2", "temp", "humid"]:
-        if stock_type in backuped_stocks:
-            stocks[stock_type]["stock"] = backuped_stocks[stock_type].get("stock", 0)
-            stocks[stock_type]["special_stocks"] = backuped_stocks[stock_type].get("special_stocks", 0)
+    portfolio.restore(client.get_user_money(user_name), client.get_user_stocks(user_name))
 
 # 既存のデータと新しいデータをマージする関数
 def update_data(first=False):
+    """追加した件数を返す"""
     print(f"[{datetime.datetime.now().strftime('%H:%M:%S')}] データの更新を開始します...")
-    # データを再取得
-    get_airoco_data()
+    # 初回は7日分を取得、2回目以降は差分のみ取得
+    if first:
+        get_airoco_data()
+        added = len(series)
+    else:
+        added = get_airoco_update()
+        print(f"[{datetime.datetime.now().strftime('%H:%M:%S')}] {added}件の新しいデータを追加しました。")
     print(f"[{datetime.datetime.now().strftime('%H:%M:%S')}] データの更新が完了しました。")
 
-    # リストのアドレスを更新しておく
-    ## 参照渡しのためアドレス更新をしないと空リストを参照してしまう
-    global select_code
-    select_code['co2']['value']   = co2_values
-    select_code["humid"]['value'] = humid_values
-    select_code["temp"]['value']  = temp_values
-
-    print(f"CO2の初期データ数:  {len(co2_values)}件")
-    print(f"気温の初期データ数: {len(temp_values)}件")
-    print(f"湿度の初期データ数: {len(humid_values)}件")
-
-    # 初回のみhandle_positionを最後に(最新データ部分に移動)
-    if first:
-        global scroll_index
-        scroll_index = max(0, len(select_code[now_graph]['value']) - WINDOW_SIZE)
-        update_handle_position()
+    # スクロール位置の調整は描画ループ側で新しいスナップショットを受け取った時に行う
+    print(f"保持しているデータ数: {len(series)}件 (センサー停止区間: {len(series.snapshot.gaps)}箇所)")
+    return added
+
+last_update_seconds = None  # 直近のupdate_dataにかかった時間(プロファイラの表示用)
+last_update_at = None       # 直近のupdate_dataが終わった時刻
+
+# スケジューラから呼ばれるデータ更新。結果を記録し、描画ループに次回の予約を依頼する
+def scheduled_update(first=False):
+    global last_update_seconds, last_update_at
+    started = time.perf_counter()
+    try:
+        added = update_data(first)
+    except Exception as e:
+        fetch_scheduler.failure()
+        print(f"[{datetime.datetime.now().strftime('%H:%M:%S')}] データの更新に失敗しました: {e}")
+    else:
+        fetch_scheduler.success(added, series.snapshot['timestamp'])
+    finally:
+        last_update_seconds = time.perf_counter() - started
+        last_update_at = datetime.datetime.now()
+        pygame.event.post(pygame.event.Event(FETCH_DONE_EVENT))
 
 
 # --- Pygame 初期化 ---
-pygame.init()
-screen = pygame.display.set_mode((500, 600))    # ウィンドウサイズを500x600に設定
-pygame.display.set_caption("Airoco-fx")    # タイトル設定
-font = pygame.font.SysFont("Meiryo", 18)        # フォント設定
-font_s = pygame.font.SysFont("Meiryo", 11)
-font_l = pygame.font.SysFont("Meiryo", 22)
-clock = pygame.time.Clock()
-
-# アイコンの設定
-pygame.image.load('icon.png')
-pygame.display.set_icon(pygame.image.load('icon.png'))
+# 画面とフォントは init_display() で用意する(importしただけではウィンドウを開かない)
+screen = None
+font = None
+font_s = None
+font_l = None
+clock = None
+layers = None   # 描画の層(render.LayeredScreen)
 
 # --- 色の定義 ---
 COLOR_WHITE = (255, 255, 255)
@@ -117,46 +216,49 @@ COLOR_BUTTON_ACTIVE = (180, 220, 255)
 
 # --- データ更新イベント定義 ---
 UPDATE_DATA_EVENT = pygame.USEREVENT + 1
-UPDATE_INTERVAL_MS = 150 * 1000  # データ更新間隔を150秒に設定(150 * 1000ミリ秒)
-pygame.time.set_timer(UPDATE_DATA_EVENT, UPDATE_INTERVAL_MS)
+UPDATE_INTERVAL_MS = trading.TICK_SECONDS * 1000  # 交渉価格の更新とバックアップ送信の間隔(150秒 = 150 * 1000ミリ秒)
+
+# データの取得はセンサーの送信周期に合わせて1回ずつ予約する(固定間隔のタイマーは使わない)
+FETCH_DATA_EVENT = pygame.USEREVENT + 2   # 予約した取得時刻になった
+FETCH_DONE_EVENT = pygame.USEREVENT + 3   # 取得が終わった(成功・失敗とも)
+BACKFILL_DONE_EVENT = pygame.USEREVENT + 4  # 遡り読み込みが終わった
+fetch_scheduler = scheduler.FetchScheduler()
 
-# 各値の初期値は空リスト
-timestamps, co2_values, temp_values, humid_values = [], [], [], []
+def schedule_next_fetch():
+    delay = fetch_scheduler.next_delay()
+    pygame.time.set_timer(FETCH_DATA_EVENT, max(1, int(delay * 1000)), loops=1)
+    print(f"[{datetime.datetime.now().strftime('%H:%M:%S')}] 次のデータ取得: {delay:.0f}秒後")
 
-# 初期データ格納庫
+# 時系列データ(CO2濃度, 気温, 湿度, タイムスタンプ)は事前確保したNumPy配列で保持する
+SERIES_MAX_DAYS = 90      # メモリに保持する最大日数(遡り読み込みもここまで)
+series = series_store.SeriesStore(capacity=series_store.SAMPLES_PER_DAY * SERIES_MAX_DAYS)
+# 1回の取得で全センサー(部屋)分を振り分けて保持する。表示・売買の対象は SENSOR_NAME の series
+sensor_series = {airoco.SENSOR_NAME: series}
+
+snapshot = series.snapshot  # 描画ループが今のフレームで使っているスナップショット
+
+# グラフの種類ごとの表示情報(値は snapshot から列名で取り出す)
 select_code = {
-    "co2": {"value": co2_values, "label": "CO₂", "unit": "ppm"},
-    "temp": {"value": temp_values, "label": "気温", "unit": "°C"},
-    "humid": {"value": humid_values, "label": "湿度", "unit": "%"}
+    "co2": {"label": "CO₂", "unit": "ppm"},
+    "temp": {"label": "気温", "unit": "°C"},
+    "humid": {"label": "湿度", "unit": "%"}
 }
 
 now_graph = "co2"  # 現在表示中のグラフの種類
 
 
 # --- 短時間用 ---
-SPECIAL_OFF = "OFF"
-SPECIAL_SELECTING = "SELECTING"
-SPECIAL_ACTIVE = "ACTIVE"
-special_state = { 
-    "co2": SPECIAL_OFF, 
-    "temp": SPECIAL_OFF, 
-    "humid": SPECIAL_OFF 
-}
-
-cooldown = {
-    "co2": None,
-    "temp": None,
-    "humid": None
-}
+SPECIAL_OFF = trading.SPECIAL_OFF
+SPECIAL_SELECTING = trading.SPECIAL_SELECTING
+SPECIAL_ACTIVE = trading.SPECIAL_ACTIVE
 
 
 # --- ゲーム変数 ---
-money = 0
-stocks = {
-    "co2": {"stock" : 0, "buy_price" : 0, "sell_price" : 0 , "profit": 0, "special_stocks": 0, "negotiation_price" :0},      # CO2株の保有数と合計購入価格と合計売値金と特別株数と損益
-    "temp": {"stock" : 0, "buy_price" : 0, "sell_price" : 0 , "profit": 0, "special_stocks": 0, "negotiation_price" :0},      # 気温株の保有数と合計購入価格と合計売値金と特別株数と損益
-    "humid": {"stock" : 0, "buy_price" : 0, "sell_price" : 0 , "profit": 0, "special_stocks": 0, "negotiation_price" :0}       # 湿度株の保有数と合計購入価格と合計売値金と特別株数と損益
-}
+# 所持金・保有株・短時間モードの状態は trading.Portfolio が持ち、売買はその注文APIで行う
+portfolio = trading.Portfolio()
+stocks = portfolio.stocks                 # 以下は表示・バックアップ送信用(portfolioと同じ辞書)
+special_state = portfolio.special_state
+cooldown = portfolio.cooldown
 
 input_quantity = ""  # 数字を文字列で一時保存
 price_desk = {
@@ -172,9 +274,18 @@ HANDLE_WIDTH = 40
 handle_rect = pygame.Rect(SCROLL_BAR_RECT.left, SCROLL_BAR_RECT.top - 5, HANDLE_WIDTH, 20)
 UI_AREA_Y = SCROLL_BAR_RECT.bottom + 3  # UIエリアのY座標
 WINDOW_SIZE = 288   # 1日分のデータ数
-scroll_index = max(0, len(select_code[now_graph]["value"]) - WINDOW_SIZE)  # スクロール位置の最初の位置（例: 1200件-288件目でスクロール開始位置が912番目から）
+ZOOM_LEVELS = (WINDOW_SIZE, WINDOW_SIZE * 7, WINDOW_SIZE * 30)  # 表示期間(1日, 1週間, 1ヶ月)
+window_size = WINDOW_SIZE  # 現在の表示件数(↑↓キー・マウスホイールで切り替え)
+scroll_index = max(0, len(snapshot) - window_size)  # スクロール位置の最初の位置（例: 1200件-288件目でスクロール開始位置が912番目から）
 dragging = False
+mouse_x_offset = 0 # ドラッグ開始時のハンドル内のマウス位置
 scroll_counter = 0 # スクロールカウンター
+BACKFILL_MARGIN = WINDOW_SIZE // 2  # 先頭からこの件数以内までスクロールしたら過去データを読み込む
+backfill_pending = False            # 遡り読み込みの実行中フラグ
+backfill_exhausted = False          # これ以上遡れないフラグ
+BACKFILL_MAX_EMPTY_DAYS = 7         # データの無い日がこの日数続いたら遡りをやめる
+backfill_empty_days = 0             # 連続してデータの無かった日数(次はその分さらに前の日を取得する)
+backfill_retry_at = 0.0             # 取得に失敗した時、この時刻(time.time())までは再試行しない
 
 # ボタンの定義
 BUTTON_WIDTH, BUTTON_HEIGHT = 50, 30
@@ -245,33 +356,43 @@ def input_user_name(screen, font, font_l) -> str:
                     if len(input_text) < 12:
                         input_text += event.unicode
 
+def set_zoom(step):
+    """表示期間を1段階切り替える。右端(表示中の最新時刻)は固定したまま幅だけ変える"""
+    global window_size, scroll_index
+    index = ZOOM_LEVELS.index(window_size) + step
+    if not 0 <= index < len(ZOOM_LEVELS):
+        return
+    end_index = scroll_index + window_size
+    window_size = ZOOM_LEVELS[index]
+    scroll_index = min(max(0, end_index - window_size), max(0, len(snapshot) - window_size))
+    update_handle_position()
+
 def update_handle_position():
     """scroll_indexに基づいてスクロールバーハンドルの位置を更新する"""
-    max_scroll = max(0, len(select_code[now_graph]["value"]) - WINDOW_SIZE)
+    max_scroll = max(0, len(snapshot) - window_size)
     if max_scroll > 0:
         scroll_ratio = scroll_index / max_scroll
         handle_rect.x = SCROLL_BAR_RECT.left + scroll_ratio * (SCROLL_BAR_RECT.width - HANDLE_WIDTH)
     else:
         handle_rect.x = SCROLL_BAR_RECT.left
 
+text_cache = render.TextCache()  # 全ての描画関数で共有する文字のSurfaceのキャッシュ
+
 # 累計収益を表示するヘッダー情報を描画する関数
 def draw_header_info(profit):
     if profit >= 0:
         profit_color, sign = COLOR_BLUE, "+"
     else:
         profit_color, sign = COLOR_RED, ""
-    profit_text = font_l.render(f"累計損益: {sign}{profit:,.1f}rco", True, profit_color)
+    profit_text = text_cache.render(font_l, f"累計損益: {sign}{profit:,.1f}rco", True, profit_color)
     screen.blit(profit_text, (GRAPH_RECT.right - profit_text.get_width(), 60))
 
-    # 区切り線を描画
-    pygame.draw.line(screen, COLOR_BLACK, (0, 55), (screen.get_width(), 55))  # 区切り線
-
     # 短時間モード
     button_color = COLOR_BUTTON_ACTIVE if special_state[now_graph] == SPECIAL_SELECTING or special_state[now_graph] == SPECIAL_ACTIVE else COLOR_BUTTON
     pygame.draw.rect(screen, button_color, SPECIAL_BUTTON_RECT, border_radius=5)
     pygame.draw.rect(screen, COLOR_BLACK, SPECIAL_BUTTON_RECT, 1, border_radius=5)
 
-    label = font.render("短時間モード", True, COLOR_BLACK)
+    label = text_cache.render(font, "短時間モード", True, COLOR_BLACK)
     screen.blit(label, label.get_rect(center=SPECIAL_BUTTON_RECT.center))
 
 
@@ -281,67 +402,63 @@ def draw_buttons(active_type):
         color = COLOR_BUTTON_ACTIVE if type_name == active_type else COLOR_BUTTON
         pygame.draw.rect(screen, color, rect, border_radius=5)
         pygame.draw.rect(screen, COLOR_BLACK, rect, 1, border_radius=5)
-        text_surf = font.render(select_code[type_name]["label"], True, COLOR_BLACK)
+        text_surf = text_cache.render(font, select_code[type_name]["label"], True, COLOR_BLACK)
         screen.blit(text_surf, text_surf.get_rect(center=rect.center))
 
+tick_label_cache = chart.LRUCache()              # X軸ラベル文字列のキャッシュ
+geometry_cache = chart.LRUCache(maxsize=16)      # グラフの画面座標のキャッシュ
+
 # グラフを描画する関数
-def draw_graph(prices, times, start_index, unit):
+def draw_graph(snap, graph_type, start_index, unit):
 
     """グラフを描画する"""
     pygame.draw.rect(screen, COLOR_WHITE, GRAPH_RECT) # グラフ背景
     
-    end_index = min(start_index + WINDOW_SIZE, len(prices)) # 表示するデータの終端インデックス
-    visible_prices = prices[start_index:end_index]
-    visible_times = times[start_index:end_index]
+    end_index = min(start_index + window_size, len(snap)) # 表示するデータの終端インデックス
+    visible_count = end_index - start_index
+    visible_times = snap.window('timestamp', start_index, end_index)
 
     # データ取得中の処理
-    if len(visible_prices) < 2:
-        msg = font.render("データ取得中です...", True, COLOR_BLACK)
+    if visible_count < 2:
+        msg = text_cache.render(font, "データ取得中です...", True, COLOR_BLACK)
         screen.blit(msg, msg.get_rect(center=GRAPH_RECT.center))
         pygame.draw.rect(screen, COLOR_BLACK, GRAPH_RECT, 1) # 枠線だけ描画
         return
 
-    # グラフのスケーリング処理
-    max_price = max(visible_prices)
-    min_price = min(visible_prices)
-    price_range = max_price - min_price
-    if price_range == 0: price_range = 1
-
-    # グラフの軸の幅
-    scale_x = GRAPH_RECT.width / (len(visible_prices) - 1) if len(visible_prices) > 1 else 0
-    scale_y = (GRAPH_RECT.height - 40) / price_range 
-
-    points = []
-    for i in range(len(visible_prices)):
-        x = GRAPH_RECT.left + i * scale_x                                           # X座標の位置
-        y = GRAPH_RECT.bottom - 20 - (visible_prices[i] - min_price) * scale_y      # Y座標の位置
-        points.append((x, y))   # points[i] = (x座標, y座標)
-    if len(points) > 1:
-        pygame.draw.lines(screen, COLOR_GREEN, False, points, 2)
+    # 表示件数がグラフの横幅(px)を超える時だけピラミッドでmin/maxに間引き、描く点の数を横幅以内に抑える
+    # (1日分の288件などは生データのまま描く)。画面座標は表示範囲・データ版・グラフ領域が変わるまで使い回す
+    max_buckets = GRAPH_RECT.width // 2 if visible_count > GRAPH_RECT.width else visible_count
+    geometry = geometry_cache.get(
+        (snap.version, graph_type, start_index, visible_count, tuple(GRAPH_RECT)),
+        lambda: chart.compute_geometry(*snap.downsample(graph_type, start_index, end_index, max_buckets),
+                                       visible_count, tuple(GRAPH_RECT)),
+    )
+    scale_x = geometry.scale_x
+    if geometry.points:
+        pygame.draw.lines(screen, COLOR_GREEN, False, geometry.points, 2)
 
     # Y軸の目盛り
     for i in range(5):
-        price = min_price + (price_range / 4 * i)   # 目盛りの値
-        y = GRAPH_RECT.bottom - 20 - (price - min_price) * scale_y      # Y座標の位置
-        label = font_s.render(f"{int(price)}", True, COLOR_BLACK)
+        price = geometry.min_value + (geometry.value_range / 4 * i)   # 目盛りの値
+        y = geometry.y(price)      # Y座標の位置
+        label = text_cache.render(font_s, f"{int(price)}", True, COLOR_BLACK)
         screen.blit(label, (GRAPH_RECT.left - 40, y - label.get_height()/2))
         pygame.draw.line(screen, COLOR_SCROLL_BG, (GRAPH_RECT.left-5, y), (GRAPH_RECT.left, y))     # 補助線
     # Y軸の単位ラベル
-    unit_label = font_s.render(f"({unit})", True, COLOR_BLACK)
+    unit_label = text_cache.render(font_s, f"({unit})", True, COLOR_BLACK)
     screen.blit(unit_label, (GRAPH_RECT.left - 35, GRAPH_RECT.top - 5))
 
     # X軸の目盛りとラベルを描画
-    num_labels = 5 
-    step = max(1, len(visible_times) // num_labels)
-    for i in range(0, len(visible_times), step):    # 0からvisible_timesの長さまでstep間隔でループ
+    # 目盛りは正時などきりの良い時刻に揃えるので、スクロールしてもラベルの文字列は変わらない
+    tick_positions, tick_times = chart.time_ticks(visible_times, max_ticks=5)
+    label_texts = tick_label_cache.get(tuple(tick_times.tolist()), lambda: chart.format_tick_labels(tick_times))
+    for i, label_text in zip(tick_positions.tolist(), label_texts):
         x = GRAPH_RECT.left + i * scale_x
-        label_text = visible_times[i].strftime("%m/%d %H:%M")
-        label = font_s.render(label_text, True, COLOR_BLACK)
-        label = pygame.transform.rotate(label, 45)  # ラベルを45度回転
+        label = text_cache.render(font_s, label_text, True, COLOR_BLACK, 45)  # 45度回転した描画結果は文字列ごとに使い回す
         screen.blit(label, (x - 15, GRAPH_RECT.bottom + 10))
 
     # 現在位置の縦線
-    indicator_x = GRAPH_RECT.left + (len(visible_prices) - 1) * scale_x
+    indicator_x = GRAPH_RECT.left + (visible_count - 1) * scale_x
     pygame.draw.line(screen, COLOR_INDICATOR, (indicator_x, GRAPH_RECT.top), (indicator_x, GRAPH_RECT.bottom), 1)
 
     # グラフの枠線を描画
@@ -354,11 +471,11 @@ def draw_ui(current_price, money_val, stock_val, now_price):
 
     # 入力
     if state == SPECIAL_SELECTING:
-        price_text = font.render(f"現在値: {now_price:.2f} rco", True, COLOR_BLACK)
-        money_text = font.render(f"所持金: ¥{money_val:,}", True, COLOR_BLACK)
-        select_text = font.render("購入株数を入力してください", True, COLOR_RED)
+        price_text = text_cache.render(font, f"現在値: {now_price:.2f} rco", True, COLOR_BLACK)
+        money_text = text_cache.render(font, f"所持金: ¥{money_val:,}", True, COLOR_BLACK)
+        select_text = text_cache.render(font, "購入株数を入力してください", True, COLOR_RED)
         input_display = input_quantity if input_quantity else "_"
-        input_text = font.render(f"選択株数: {input_display}", True, COLOR_BLUE)
+        input_text = text_cache.render(font, f"選択株数: {input_display}", True, COLOR_BLUE)
 
         screen.blit(price_text, (GRAPH_RECT.left, status_y_start))
         screen.blit(money_text, (GRAPH_RECT.left, status_y_start + 30))
@@ -366,34 +483,34 @@ def draw_ui(current_price, money_val, stock_val, now_price):
         screen.blit(input_text, (GRAPH_RECT.left, status_y_start + 90))
 
         help_x = screen.get_width()/2 + 40
-        buy_text = font.render("Enter: 購入確定", True, COLOR_BLACK)
-        sell_text = font.render("BS: 削除", True, COLOR_BLACK)
+        buy_text = text_cache.render(font, "Enter: 購入確定", True, COLOR_BLACK)
+        sell_text = text_cache.render(font, "BS: 削除", True, COLOR_BLACK)
         screen.blit(buy_text, (help_x, status_y_start))
         screen.blit(sell_text, (help_x, status_y_start + 30))
 
         # 購入できる最大を表示
         max_quantity = (money_val // current_price) if current_price > 0 else 0
-        max_quantity_text = font.render(f"最大購入可能株数: {int(max_quantity)}", True, COLOR_BLACK)
+        max_quantity_text = text_cache.render(font, f"最大購入可能株数: {int(max_quantity)}", True, COLOR_BLACK)
         screen.blit(max_quantity_text, (help_x, status_y_start + 90))
 
         # 所持金不足メッセージの表示
         if no_money_message and (pygame.time.get_ticks() - message_display_time < 3000): # 3秒間表示
-            message_surf = font.render(no_money_message, True, COLOR_RED)
+            message_surf = text_cache.render(font, no_money_message, True, COLOR_RED)
             screen.blit(message_surf, (GRAPH_RECT.left, status_y_start + 125))
 
     # 短時間モード中
     elif state == SPECIAL_ACTIVE:
         negotiated_price_display = stock_val[now_graph]["negotiation_price"]
-        negotiated_price_text = font.render(f"交渉価格: {negotiated_price_display:.2f} rco", True, COLOR_BLACK)
-        scrolled_price_text = font.render(f"表示価格: {current_price:.2f} rco", True, COLOR_BLACK) # スクロール時点の価格表示
+        negotiated_price_text = text_cache.render(font, f"交渉価格: {negotiated_price_display:.2f} rco", True, COLOR_BLACK)
+        scrolled_price_text = text_cache.render(font, f"表示価格: {current_price:.2f} rco", True, COLOR_BLACK) # スクロール時点の価格表示
 
-        stock_text = font.render(f"短期株保有数: {stock_val[now_graph]['special_stocks']}株", True, COLOR_BLACK)
+        stock_text = text_cache.render(font, f"短期株保有数: {stock_val[now_graph]['special_stocks']}株", True, COLOR_BLACK)
         remaining = 3600 - int((datetime.datetime.now() - cooldown[now_graph]).total_seconds())
         minutes = max(0, remaining // 60)
         seconds = max(0, remaining % 60)
 
-        time_text = font.render(f"残り時間: {minutes:02}:{seconds:02}", True, COLOR_RED)
-        notice_text = font.render("売却のみ可能です", True, COLOR_BLACK)
+        time_text = text_cache.render(font, f"残り時間: {minutes:02}:{seconds:02}", True, COLOR_RED)
+        notice_text = text_cache.render(font, "売却のみ可能です", True, COLOR_BLACK)
 
         screen.blit(negotiated_price_text, (GRAPH_RECT.left, status_y_start))
         screen.blit(scrolled_price_text, (GRAPH_RECT.left, status_y_start + 30)) 
@@ -402,17 +519,17 @@ def draw_ui(current_price, money_val, stock_val, now_price):
         screen.blit(notice_text, (GRAPH_RECT.left, status_y_start + 120))
 
         help_x = screen.get_width()/2 + 40
-        sell_text = font.render("Sキー: 売る", True, COLOR_RED)
-        scroll_text = font.render("←→: スクロール", True, COLOR_BLACK)
+        sell_text = text_cache.render(font, "Sキー: 売る", True, COLOR_RED)
+        scroll_text = text_cache.render(font, "←→: スクロール", True, COLOR_BLACK)
         screen.blit(sell_text, (help_x, status_y_start ))
         screen.blit(scroll_text, (help_x, status_y_start + 30))
 
     # 通常時
     else:
-        price_text = font.render(f"現在値: {now_price:.2f} rco", True, COLOR_BLACK)
-        scrolled_price_text = font.render(f"表示価格: {current_price:.2f} rco", True, COLOR_BLACK) # スクロール時点の価格表示
-        money_text = font.render(f"所持金: ¥{money_val:,}", True, COLOR_BLACK)
-        stock_text = font.render(f"保有株: {stock_val[now_graph]['stock']}株", True, COLOR_BLACK)
+        price_text = text_cache.render(font, f"現在値: {now_price:.2f} rco", True, COLOR_BLACK)
+        scrolled_price_text = text_cache.render(font, f"表示価格: {current_price:.2f} rco", True, COLOR_BLACK) # スクロール時点の価格表示
+        money_text = text_cache.render(font, f"所持金: ¥{money_val:,}", True, COLOR_BLACK)
+        stock_text = text_cache.render(font, f"保有株: {stock_val[now_graph]['stock']}株", True, COLOR_BLACK)
         screen.blit(price_text, (GRAPH_RECT.left, status_y_start))
         screen.blit(scrolled_price_text, (GRAPH_RECT.left, status_y_start + 30))  # スクロール時点の価格表示
         screen.blit(money_text, (GRAPH_RECT.left, status_y_start + 60))
@@ -420,38 +537,151 @@ def draw_ui(current_price, money_val, stock_val, now_price):
 
         # 操作説明
         help_x = screen.get_width()/2 + 40
-        buy_text = font.render("Bキー: 買う", True, COLOR_BLUE)
-        sell_text = font.render("Sキー: 売る", True, COLOR_RED)
-        scroll_text = font.render("←→: スクロール", True, COLOR_BLACK)
-        attention_text = font.render("※CO2株は1株単位、気温・湿度株は10株単位で購入", True, COLOR_BLACK)
+        buy_text = text_cache.render(font, "Bキー: 買う", True, COLOR_BLUE)
+        sell_text = text_cache.render(font, "Sキー: 売る", True, COLOR_RED)
+        scroll_text = text_cache.render(font, "←→: スクロール", True, COLOR_BLACK)
+        zoom_text = text_cache.render(font, "↑↓: 表示期間", True, COLOR_BLACK)
+        attention_text = text_cache.render(font, "※CO2株は1株単位、気温・湿度株は10株単位で購入", True, COLOR_BLACK)
         screen.blit(buy_text, (help_x, status_y_start))
         screen.blit(sell_text, (help_x, status_y_start + 30))
         screen.blit(scroll_text, (help_x, status_y_start + 60))
+        screen.blit(zoom_text, (help_x, status_y_start + 90))
         # 注意書きの中央揃え
         center = (screen.get_width() - attention_text.get_width()) // 2
         screen.blit(attention_text, (center, status_y_start + 130))
 
 def draw_scrollbar():
-    """スクロールバーを描画する"""
-    pygame.draw.rect(screen, COLOR_SCROLL_BG, SCROLL_BAR_RECT)
+    """スクロールバーのハンドルを描画する(溝は背景に描いてある)"""
     pygame.draw.rect(screen, COLOR_SCROLL_HANDLE, handle_rect, border_radius=5)
 
-def special_mode_calculate(now_price, last_price, time, negotiation_price):
-    magnification = 1.0 +  0.25 * math.exp(time)                    # 特別倍率 = 1.0 + 0.25 * e^(時間経過)
-
-    if last_price == 0:
-        rate = 0.0
-    else:
-        rate = (now_price - last_price) / last_price                # 価格変動率 = (現在価格 - 前回価格) / 前回価格
-
-    bonus = 1 + (rate * magnification)                              # ボーナス計算
+def draw_chrome(surface):
+    """変化しない背景(背景色・区切り線・スクロールバーの溝)を描く。起動時に1度だけ呼ばれる"""
+    surface.fill(COLOR_BG)
+    pygame.draw.line(surface, COLOR_BLACK, (0, 55), (surface.get_width(), 55))  # 区切り線
+    pygame.draw.rect(surface, COLOR_SCROLL_BG, SCROLL_BAR_RECT)
+
+# --- 描画の層 ---
+# 画面を上から4つの帯に分け、帯ごとに入力が変わった時だけ描き直して、その矩形だけを画面に反映する
+HEADER_AREA = pygame.Rect(0, 0, 500, GRAPH_RECT.top - 6)                                        # 短時間モード・種類ボタン・累計損益
+CHART_AREA = pygame.Rect(0, HEADER_AREA.bottom, 500, handle_rect.top - 2 - HEADER_AREA.bottom)  # グラフと軸ラベル
+SCROLL_AREA = pygame.Rect(0, CHART_AREA.bottom, 500, handle_rect.bottom - CHART_AREA.bottom)    # スクロールバー
+UI_AREA = pygame.Rect(0, SCROLL_AREA.bottom, 500, 600 - SCROLL_AREA.bottom)                     # 価格・所持金・操作説明
+
+def init_display(headless=False):
+    """ウィンドウ・フォント・描画の層を用意する。headless=Trueなら画面を持たないダミーのドライバで動かす"""
+    global screen, font, font_s, font_l, clock, layers
+    if headless:
+        os.environ['SDL_VIDEODRIVER'] = 'dummy'
+    pygame.init()
+    screen = pygame.display.set_mode((500, 600))    # ウィンドウサイズを500x600に設定
+    pygame.display.set_caption("Airoco-fx")    # タイトル設定
+    font = pygame.font.SysFont("Meiryo", 18)        # フォント設定
+    font_s = pygame.font.SysFont("Meiryo", 11)
+    font_l = pygame.font.SysFont("Meiryo", 22)
+    clock = pygame.time.Clock()
+
+    # アイコンの設定
+    pygame.display.set_icon(pygame.image.load('icon.png'))
+
+    layers = render.LayeredScreen(screen, draw_chrome)
+    layers.add('header', HEADER_AREA, draw_header_layer)
+    layers.add('chart', CHART_AREA, draw_chart_layer)
+    layers.add('scroll', SCROLL_AREA, draw_scrollbar)
+    layers.add('ui', UI_AREA, draw_ui_layer)
+
+def draw_header_layer():
+    draw_buttons(now_graph)
+    draw_header_info(stocks[now_graph]["profit"])
 
-    if negotiation_price == 0:
-        new_negotiation_price = int(last_price * bonus)             # ボーナスを適用した価格
+def draw_chart_layer():
+    draw_graph(snapshot, now_graph, scroll_index, active_unit)
+
+def draw_ui_layer():
+    draw_ui(current_price, portfolio.money, stocks, price_desk[now_graph]['now_price'])
+
+# --- フレームレート ---
+# ドラッグ中・長押しスクロール中だけ60FPSで回し、それ以外はイベントが来るまで待つ
+FPS = 60
+IDLE_TIMEOUT_MS = 10 * 1000     # 何も起きなくても最低この間隔で1フレーム回す
+HIDDEN_TIMEOUT_MS = 60 * 1000   # 最小化されている時の間隔
+
+def is_animating():
+    """毎フレーム描き直す必要がある操作の最中か"""
+    pressed = pygame.key.get_pressed()
+    return dragging or pressed[pygame.K_LEFT] or pressed[pygame.K_RIGHT]
+
+def idle_timeout():
+    """次に画面の表示が変わる時刻(残り時間の秒の切り替わり・メッセージの消去)までのミリ秒"""
+    if not pygame.display.get_active():
+        return HIDDEN_TIMEOUT_MS
+    timeout = IDLE_TIMEOUT_MS
+    if show_profiler:
+        timeout = 1000  # プロファイラの表示中は1秒ごとに数値を更新する
+    if cooldown[now_graph]:
+        elapsed_ms = int((datetime.datetime.now() - cooldown[now_graph]).total_seconds() * 1000)
+        timeout = min(timeout, 1000 - elapsed_ms % 1000)
+    if no_money_message:
+        timeout = min(timeout, max(1, 3000 - (pygame.time.get_ticks() - message_display_time)))
+    return timeout
+
+def next_events():
+    """このフレームで処理するイベントを返す。操作中でなければ届くまで(最大でidle_timeout)待つ"""
+    if is_animating():
+        return pygame.event.get()
+    event = pygame.event.wait(idle_timeout())   # タイマー(データ取得・バックアップ)や取得完了でも起きる
+    if event.type == pygame.NOEVENT:
+        return []
+    return [event] + pygame.event.get()
+
+# --- フレームプロファイラ ---
+# F3キーで表示の切り替え、F4キーで保持しているフレームの計測値をCSVに書き出す
+show_profiler = False
+PROFILER_RECT = pygame.Rect(270, GRAPH_RECT.top + 2, 228, 0)  # 高さは表示する行数で決まる
+PROFILER_WINDOW = 120   # 平均・最大を求める直近のフレーム数
+
+def draw_profiler_overlay():
+    """段階ごとの処理時間・GC・直近のupdate_dataの時間を全ての層の上に描く。描いた矩形を返す"""
+    lines = [f"frame profiler (直近{PROFILER_WINDOW}フレーム)", ("stage", "avg ms", "max ms")]
+    for stage, row in frame_profiler.rolling(PROFILER_WINDOW).items():
+        lines.append((stage, f"{row['avg']:.2f}", f"{row['max']:.2f}"))
+    lines.append(f"GC: {frame_profiler.gc_count}回 計{frame_profiler.gc_time * 1000:.1f}ms "
+                 f"(直近 {frame_profiler.gc_last_pause * 1000:.1f}ms)")
+    if last_update_seconds is not None:
+        lines.append(f"update_data: {last_update_seconds * 1000:.0f}ms ({last_update_at.strftime('%H:%M:%S')})")
     else:
-        new_negotiation_price = int(negotiation_price * bonus)
-
-    return new_negotiation_price
+        lines.append("update_data: -")
+
+    # 数値は毎フレーム変わるので text_cache は使わない(キャッシュを使い捨ての文字列で埋めないため)
+    line_height = font_s.get_linesize()
+    rect = PROFILER_RECT.copy()
+    rect.height = line_height * len(lines) + 8
+    pygame.draw.rect(screen, (30, 30, 40), rect)
+    for i, line in enumerate(lines):
+        y = rect.top + 4 + i * line_height
+        if isinstance(line, str):
+            screen.blit(font_s.render(line, True, (220, 255, 220)), (rect.left + 6, y))
+            continue
+        # 表の行は 段階名(左揃え) / 平均・最大(右揃え) の列に揃える
+        stage, avg, peak = (font_s.render(cell, True, (220, 255, 220)) for cell in line)
+        screen.blit(stage, (rect.left + 6, y))
+        screen.blit(avg, (rect.left + 150 - avg.get_width(), y))
+        screen.blit(peak, (rect.right - 8 - peak.get_width(), y))
+    return rect
+
+def export_profile():
+    path = f"profile_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.csv"
+    count = frame_profiler.export_csv(path)
+    print(f"[{datetime.datetime.now().strftime('%H:%M:%S')}] フレームの計測値を{count}件 {path} に書き出しました。")
+
+def ui_key():
+    """draw_uiの表示内容を決める値の組(変わった時だけ描き直す)"""
+    elapsed = None
+    if cooldown[now_graph]:
+        elapsed = int((datetime.datetime.now() - cooldown[now_graph]).total_seconds())  # 残り時間は秒単位で変わる
+    message_visible = bool(no_money_message) and pygame.time.get_ticks() - message_display_time < 3000
+    return (now_graph, special_state[now_graph], current_price, portfolio.money, price_desk[now_graph]['now_price'],
+            stocks[now_graph]['stock'], stocks[now_graph]['special_stocks'], stocks[now_graph]['negotiation_price'],
+            input_quantity, message_visible, elapsed)
 
 def show_loading_screen():
     screen.fill(COLOR_BG)
@@ -462,115 +692,118 @@ def show_loading_screen():
 # --- メインループ ---
 running = True
 user_name = 'guest'
+frame_profiler = profiler.FrameProfiler()  # 1フレームの段階ごとの処理時間
 
-# ユーザー名の読み込み・登録
-if os.path.exists(USER_FILE):
-    with open(USER_FILE, 'r') as f:
-        user_name = f.read().strip()
-else:
-    user_name = input_user_name(screen, font, font_l)
-
-print(f"ログインユーザー: {user_name}")
+## series への書き込みは data_executor の1スレッドに限定する(SeriesStoreは書き込み側が1つの前提)
+executor = ThreadPoolExecutor(max_workers=2)
+data_executor = ThreadPoolExecutor(max_workers=1)
+
+def run_frame(events):
+    """1フレーム分の処理(スナップショットの受け取り・イベント処理・スクロール・損益計算・描画)"""
+    global running, snapshot, scroll_index, active_prices, active_unit, max_scroll_len, current_price
+    global no_money_message, message_display_time, input_quantity, now_graph, dragging, mouse_x_offset
+    global scroll_counter, backfill_pending, total_profit, show_profiler
+
+    # 最新のスナップショットをフレームの先頭で1回だけ受け取る(1回の参照なのでロック不要)
+    latest = series.snapshot
+    if latest.version != snapshot.version:
+        # 末尾(最新データ)を表示していた場合、または初回データの場合は更新後も末尾に留まる
+        was_at_end = scroll_index >= len(snapshot) - window_size - 1
+        # 先頭への追加や古いデータの破棄で行がずれた分を補正し、同じデータを表示し続ける
+        scroll_index += snapshot.origin - latest.origin
+        snapshot = latest
+        if was_at_end:
+            scroll_index = max(0, len(snapshot) - window_size)
+        scroll_index = min(max(0, scroll_index), max(0, len(snapshot) - window_size))
+        update_handle_position()
 
+        # 各現在の値と前の値を更新(データが変わった時だけ。損益も価格が変わった銘柄だけ計算し直される)
+        for graph_type in select_code:
+            current_prices = snapshot[graph_type]
+            if len(current_prices) > 0:
+                price_desk[graph_type]['now_price'] = current_prices[-1]
+                price_desk[graph_type]['last_price'] = current_prices[-2] if len(current_prices) > 1 else 0
+            portfolio.update_price(graph_type, price_desk[graph_type]['now_price'])
 
-# データ取得(初回のみデータ取得をしておく)
-executor = ThreadPoolExecutor(max_workers=2)
-executor.submit(update_data, first=True)
-show_loading_screen()
-
-# 非同期タスクとして実行
-money, backuped_stocks = asyncio.run(client.get_user_data_concurrently(user_name))
-for stock_type in ["co2", "temp", "humid"]:
-    if stock_type in backuped_stocks:
-        stocks[stock_type]["stock"] = backuped_stocks[stock_type].get("stock", 0)
-        stocks[stock_type]["special_stocks"] = backuped_stocks[stock_type].get("special_stocks", 0)
-
-while running:
-    active_prices = select_code[now_graph]['value']     # 表示の対象（CO2, 気温, 湿度）
+    active_prices = snapshot[now_graph]                 # 表示の対象（CO2, 気温, 湿度）
     active_unit = select_code[now_graph]['unit']        # 表示の単位（ppm, °C, %）
-    max_scroll_len = len(active_prices) - WINDOW_SIZE   # スクロール可能な最大長さ
+    max_scroll_len = max(0, len(active_prices) - window_size)   # スクロール可能な最大長さ(表示期間よりデータが少なければ0)
 
     # メッセージの表示時間を過ぎたらクリア
     if pygame.time.get_ticks() - message_display_time > 3000:
         no_money_message = ""  # 所持金不足メッセージをクリア
 
-    # 各現在の値と前の値を更新
-    for graph_type in select_code:
-        current_prices = select_code[graph_type]['value']
-        if len(current_prices) > 0:
-            price_desk[graph_type]['now_price'] = current_prices[-1]
-            price_desk[graph_type]['last_price'] = current_prices[-2] if len(current_prices) > 1 else 0
-    
     # スクロール位置に基づいて表示価格を取得
-    current_price_index = min(scroll_index + WINDOW_SIZE - 1, len(active_prices) - 1)
+    current_price_index = min(scroll_index + window_size - 1, len(active_prices) - 1)
     if current_price_index >= 0:
         current_price = active_prices[current_price_index]
     else:
         current_price = 0
 
+    frame_profiler.lap('snapshot')
+
     # --- イベント処理 ---    1フレーム毎にイベントを取得
-    for event in pygame.event.get():
-        if event.type == pygame.QUIT:
+    for event in events:
+        if event.type in (pygame.WINDOWEXPOSED, pygame.VIDEOEXPOSE):
+            layers.invalidate()  # 他のウィンドウに隠されていた部分を含めて描き直す
+
+        elif event.type == pygame.QUIT:
             running = False
             # ゲーム終了時のバックアップ
             try:
-                client.post_user_data(user_name, money, stocks)
+                client.post_user_data(user_name, portfolio.money, stocks)
                 print("バックアップ送信完了")
             except Exception as e:
                 print(f"バックアップ送信失敗: {e}")
         
+        # --- データ取得イベント ---
+        elif event.type == FETCH_DATA_EVENT:
+            # 前回の取得がまだ終わっていなければ重ねて実行しない(終わった時に改めて予約される)
+            if fetch_scheduler.begin():
+                data_executor.submit(scheduled_update)
+
+        elif event.type == FETCH_DONE_EVENT:
+            schedule_next_fetch()
+
         # --- データ更新イベント ---
         elif event.type == UPDATE_DATA_EVENT:
-            was_at_end = scroll_index >= max_scroll_len - 1
-            # データを更新とAPIサーバへの送信(2回目以降)
-            executor.submit(update_data)
-            executor.submit(client.post_user_data, user_name, money, stocks)
-
-            # 新しいデータをselect_codeに反映
-            select_code["co2"]["value"] = co2_values
-            select_code["temp"]["value"] = temp_values
-            select_code["humid"]["value"] = humid_values
+            # APIサーバへの送信(2回目以降)
+            executor.submit(client.post_user_data, user_name, portfolio.money, stocks)
 
             # 全てのグラフタイプに対して短時間モードの状態をチェックし、交渉価格の更新と強制売却を行う
             for graph_type in select_code:
+                if special_state[graph_type] != SPECIAL_ACTIVE:
+                    continue
                 # そのグラフタイプの最新価格と過去価格を取得
-                current_graph_prices = select_code[graph_type]["value"]
+                current_graph_prices = snapshot[graph_type]
                 graph_now_price = current_graph_prices[-1] if len(current_graph_prices) > 0 else 0
                 graph_last_price = current_graph_prices[-2] if len(current_graph_prices) > 1 else 0
 
-                # 短時間モードがアクティブであれば交渉価格を更新
-                if special_state[graph_type] == SPECIAL_ACTIVE and cooldown[graph_type]:
-                    elapsed = (datetime.datetime.now() - cooldown[graph_type]).total_seconds()
-                    now_time = elapsed / 3600.0
-
-                    if elapsed > 3600 and stocks[graph_type]["special_stocks"] > 0:
-                        forced_sale_price = int(stocks[graph_type]["special_stocks"] * stocks[graph_type]["negotiation_price"] * 0.9)  # 強制売却価格
-                        money += forced_sale_price                                                                                  # 売却価格を所持金に加算
-                        stocks[graph_type]["sell_price"] += forced_sale_price                                                        # 売却価格を記録
-                        stocks[graph_type]["special_stocks"] = 0                                                                     # 強制売却後は特別株を0にする
-                        special_state[graph_type] = SPECIAL_OFF                                                                      # モードを解除
-                        cooldown[graph_type] = None                                                                                  # クールダウンをリセット
-                        stocks[graph_type]["negotiation_price"] = 0.0                                                                # 交渉価格をリセット
-                        print(f"[{datetime.datetime.now().strftime('%H:%M:%S')}] 強制売却が発生しました。特別株を売却しました。")
-
-                    else:
-                        base_negotiation_price = stocks[graph_type]["negotiation_price"]
-                        # # 短時間モード開始後、最初のデータ更新時（またはnegotiation_priceがリセットされている場合）は、now_priceを基準とする
-
-                        new_negotiation_price = special_mode_calculate(graph_now_price, graph_last_price, now_time, base_negotiation_price)
-                        stocks[graph_type]["negotiation_price"] = float(new_negotiation_price)
-                        # 確認のためgraph_now_price, graph_last_price, now_time, base_negotiation_priceを表示
-                        print(f"[{datetime.datetime.now().strftime('%H:%M:%S')}] {graph_type} Negotiation Price Updated: {new_negotiation_price}, Base: {base_negotiation_price}, Now Price: {graph_now_price}, Last Price: {graph_last_price}, Time Elapsed: {now_time:.2f} hours")
-                        print(f"[{datetime.datetime.now().strftime('%H:%M:%S')}] Negotiation Price Updated for {now_graph}: {new_negotiation_price}")
-
-            # 末尾にスクロールしていた場合、更新後も末尾に留まるようにする
-            if was_at_end:
-                scroll_index = max(0, len(active_prices) - WINDOW_SIZE)
-            update_handle_position()
+                base_negotiation_price = stocks[graph_type]["negotiation_price"]
+                fill = portfolio.tick(graph_type, graph_now_price, graph_last_price)
+                if fill:
+                    print(f"[{datetime.datetime.now().strftime('%H:%M:%S')}] 強制売却が発生しました。特別株を売却しました。")
+                else:
+                    # 確認のため交渉価格の変化を表示
+                    print(f"[{datetime.datetime.now().strftime('%H:%M:%S')}] {graph_type} Negotiation Price Updated: {stocks[graph_type]['negotiation_price']}, Base: {base_negotiation_price}, Now Price: {graph_now_price}, Last Price: {graph_last_price}")
 
         # --- キー入力イベント ---
         elif event.type == pygame.KEYDOWN:
 
+            # F3キー : プロファイラの表示切り替え / F4キー : 計測値のCSV書き出し
+            if event.key == pygame.K_F3:
+                show_profiler = not show_profiler
+                if not show_profiler:
+                    layers.invalidate()  # プロファイラの下に隠れていた部分を描き直す
+            elif event.key == pygame.K_F4:
+                export_profile()
+
+            # ↑キー : 表示期間を短く / ↓キー : 表示期間を長く
+            if event.key == pygame.K_UP:
+                set_zoom(-1)
+            elif event.key == pygame.K_DOWN:
+                set_zoom(1)
+
             if price_desk[now_graph]['now_price'] == 0: continue  # 現在の価格が0の場合は何もしない
 
             # 数字入力（0～9）
@@ -583,69 +816,25 @@ while running:
 
                 print("Enterキーが押されました。")
 
-            # Bキー : 株を買う操作
-            if event.key == pygame.K_b and money >= price_desk[now_graph]['now_price']:
+            # Bキー : 株を買う操作(短時間モード中は買えない)
+            if event.key == pygame.K_b:
+                fill = portfolio.buy(now_graph, price_desk[now_graph]['now_price'])
+                if fill:
+                    print(f"[{datetime.datetime.now().strftime('%H:%M:%S')}] {now_graph} 株を {fill.quantity} 株(1株{int(fill.price)}rco) 購入しました。")
 
-                # 短時間対策
-                if special_state[now_graph] == SPECIAL_SELECTING:
-                    pass  # 買えない
-                if special_state[now_graph] == SPECIAL_ACTIVE:
-                    pass  # 買えない  
-                # 通常
-                else:
-                    if now_graph == "temp" or now_graph == "humid":
-                        stock_quantity = 10
-                    else:
-                        stock_quantity = 1
-                        
-                    if money >= price_desk[now_graph]['now_price'] * stock_quantity:
-                        stocks[now_graph]["stock"] += stock_quantity
-                        stocks[now_graph]["buy_price"] += int(price_desk[now_graph]['now_price'] * stock_quantity)
-                        money -= int(price_desk[now_graph]['now_price'] * stock_quantity)
-                        print(f"[{datetime.datetime.now().strftime('%H:%M:%S')}] {now_graph} 株を {stock_quantity} 株(1株{int(price_desk[now_graph]['now_price'])}rco) 購入しました。")
-            
             # Enterキー : 株の購入確定
             elif event.key == pygame.K_RETURN:
                 if special_state[now_graph] == SPECIAL_SELECTING:
                     if input_quantity.isdigit() and int(input_quantity) > 0:    # 数字が入力されているか確認
-                        stock_quantity = int(input_quantity)
-                        if money >= price_desk[now_graph]["now_price"] * stock_quantity:
-                            stocks[now_graph]["special_stocks"] += stock_quantity  # 特別株に追加
-                            stocks[now_graph]["buy_price"] += int(price_desk[now_graph]['now_price'] * stock_quantity) # 購入価格を記録
-                            money -= int(price_desk[now_graph]["now_price"] * stock_quantity) # 所持金から購入価格を引く
-                            special_state[now_graph] = SPECIAL_ACTIVE       # モードをアクティブにする  
-                            stocks[now_graph]["negotiation_price"] = price_desk[now_graph]["now_price"]  # 交渉価格を現在の価格に設定
-                            cooldown[now_graph] = datetime.datetime.now()
+                        if portfolio.buy_special(now_graph, int(input_quantity), price_desk[now_graph]["now_price"]):
                             input_quantity = ""  # 入力リセット
                         else:
                             no_money_message = "購入株数が多いです。所持金が足りません。"
                             message_display_time = pygame.time.get_ticks() # 現在時刻を記録
 
-            # Sキー　: 株を売る操作
+            # Sキー　: 株を売る操作(短時間モード中は交渉価格で特別株を売る。10%手数料を引く)
             elif event.key == pygame.K_s:
-                # 短時間モード中ならボーナス適用
-                if special_state[now_graph] == SPECIAL_ACTIVE:
-                    if stocks[now_graph]["special_stocks"] > 0:
-                        sell_price_base = stocks[now_graph]["negotiation_price"]
-                        # 売却価格を計算
-                        sell_price = int(sell_price_base * 0.9) # 10%手数料を引く
-                        stocks[now_graph]["special_stocks"] -= 1
-                        stocks[now_graph]["sell_price"] += sell_price   # 売却時の価格を記録
-                        money += int(sell_price)                        # 売却時は10%手数料を引いた価格を加算
-                    
-                        # 売り切ったらモード解除
-                        if stocks[now_graph]["special_stocks"] == 0:
-                            special_state[now_graph] = SPECIAL_OFF
-                            cooldown[now_graph] = None
-                            stocks[now_graph]["negotiation_price"] = 0.0
-
-                # 通常モード
-                else:
-                    if stocks[now_graph]["stock"] > 0:
-                        sell_price = int(price_desk[now_graph]["now_price"] * 0.9)  # 10%手数料を引く
-                        stocks[now_graph]["stock"] -= 1
-                        stocks[now_graph]["sell_price"] += sell_price   # 売却時の価格を記録
-                        money += int(sell_price)                        # 売却時は10%手数料を引いた価格を加算
+                portfolio.sell(now_graph, price_desk[now_graph]["now_price"])
 
         # --- マウス入力 ---
         # マウスボタンが押されたとき
@@ -657,17 +846,18 @@ while running:
                 for type_name, rect in button_map.items():
                     if rect.collidepoint(event.pos):  
                         now_graph = type_name
-                        scroll_index = max(0, len(select_code[now_graph]["value"]) - WINDOW_SIZE)
+                        scroll_index = max(0, len(snapshot) - window_size)
                         update_handle_position()
                         break
 
             # 短時間モードのボタンがクリックされた場合
             if SPECIAL_BUTTON_RECT.collidepoint(event.pos):
-                current = special_state[now_graph]
-                if current == SPECIAL_OFF:
-                    special_state[now_graph] = SPECIAL_SELECTING
-                elif current == SPECIAL_SELECTING:
-                    special_state[now_graph] = SPECIAL_OFF
+                portfolio.toggle_special(now_graph)
+
+        # グラフ上でのマウスホイール : 表示期間の切り替え
+        elif event.type == pygame.MOUSEWHEEL:
+            if GRAPH_RECT.collidepoint(pygame.mouse.get_pos()):
+                set_zoom(-1 if event.y > 0 else 1)
 
         # マウスボタンが離されたとき
         elif event.type == pygame.MOUSEBUTTONUP:    
@@ -680,17 +870,19 @@ while running:
                 handle_rect.x = max(SCROLL_BAR_RECT.left, min(new_x, SCROLL_BAR_RECT.right - HANDLE_WIDTH))
                 if (SCROLL_BAR_RECT.width - HANDLE_WIDTH) > 0:
                     scroll_ratio = (handle_rect.x - SCROLL_BAR_RECT.left) / (SCROLL_BAR_RECT.width - HANDLE_WIDTH)
-                    scroll_index = int(scroll_ratio * max_scroll_len)
+                    scroll_index = min(max(0, int(scroll_ratio * max_scroll_len)), max_scroll_len)
                     
+    frame_profiler.lap('events')
+
     # --- 長押し対応 ---
     pressedkeys = pygame.key.get_pressed()
-    scroll_speed = 1 # スクロールで移動する量
-    scroll_frame = 6 # スクロールのフレーム数 60FPSのため、0.1秒ごとになるように調整
+    scroll_speed = window_size // WINDOW_SIZE # スクロールで移動する量(表示期間が長いほど速く)
+    scroll_frame = 6 # スクロールのフレーム数 長押し中は60FPSのため、0.1秒ごとになるように調整
     # →キー : スクロールバーを右に移動
     if pressedkeys[pygame.K_RIGHT]:
         scroll_counter += 1
         if scroll_counter % scroll_frame == 0:  # scroll_frameフレームごとにスクロール
-            scroll_index = min(scroll_index + scroll_speed, max_scroll_len) # 末尾を超えないようにする
+            scroll_index = min(max(0, scroll_index + scroll_speed), max_scroll_len) # 先頭・末尾を超えないようにする
             update_handle_position() 
     # ←キー : スクロールバーを左に移動
     elif pressedkeys[pygame.K_LEFT]:
@@ -701,29 +893,64 @@ while running:
     else:
         scroll_counter = 0  # キーを離したらカウンターをリセット
 
+    # 先頭付近までスクロールしたら、描画を止めずに裏で1日前のデータを読み込む
+    if (scroll_index <= BACKFILL_MARGIN and len(snapshot) > 0 and not backfill_pending and not backfill_exhausted
+            and time.time() >= backfill_retry_at):
+        backfill_pending = True
+        data_executor.submit(backfill_history)
+
+    frame_profiler.lap('scroll')
+
     # --- 画面描画 ---
-    screen.fill(COLOR_BG)
+    # 各株の損益と合計収益(約定・価格の更新時に計算済みの値を読むだけ)
+    total_profit = portfolio.total_profit
+
+    frame_profiler.lap('profit')
+
+    # 描画関数の呼び出し(入力が前のフレームと同じ層は描かず、変わった矩形だけ画面に反映する)
+    # 最小化中は描かない(元に戻った時の WINDOWEXPOSED で全体を描き直す)
+    if pygame.display.get_active():
+        layers.render([
+            (now_graph, special_state[now_graph], round(stocks[now_graph]["profit"], 1)),
+            (snapshot.version, now_graph, scroll_index, window_size),
+            handle_rect.x,
+            ui_key(),
+        ], frame_profiler, draw_profiler_overlay if show_profiler else None)
+
+def main():
+    global running, user_name
+
+    init_display()
+    frame_profiler.track_gc()
+    pygame.time.set_timer(UPDATE_DATA_EVENT, UPDATE_INTERVAL_MS)
+
+    # ユーザー名の読み込み・登録
+    if os.path.exists(USER_FILE):
+        with open(USER_FILE, 'r') as f:
+            user_name = f.read().strip()
+    else:
+        user_name = input_user_name(screen, font, font_l)
 
-    # 各株の損益を計算
-    for graph_type in select_code:
-        possession_money = stocks[graph_type]["sell_price"] + (stocks[graph_type]["stock"] * price_desk[graph_type]["now_price"])  # 現在の持ち金 = 売却済み資産 + 現在の株価 * 保有株数
-        if special_state[graph_type] == SPECIAL_ACTIVE:
-            special_money = stocks[graph_type]["special_stocks"] * stocks[graph_type]["negotiation_price"]
-            possession_money += special_money
+    print(f"ログインユーザー: {user_name}")
 
-        stocks[graph_type]["profit"] = possession_money - stocks[graph_type]["buy_price"]  # 損益 = 現在の持ち金 - 購入金額
-        
-    # 合計収益計算
-    total_profit = sum(stocks[graph_type]["profit"] for graph_type in stocks)
+    # データ取得(初回のみデータ取得をしておく)
+    fetch_scheduler.begin()
+    data_executor.submit(scheduled_update, first=True)
+    show_loading_screen()
 
-    # 描画関数の呼び出し
-    draw_buttons(now_graph)
-    draw_header_info(stocks[now_graph]["profit"])
-    draw_graph(active_prices, timestamps, scroll_index, active_unit)
-    draw_ui(current_price, money, stocks, price_desk[now_graph]['now_price'])
-    draw_scrollbar()
+    # 非同期タスクとして実行
+    portfolio.restore(*asyncio.run(client.get_user_data_concurrently(user_name)))
+
+    while running:
+        events = next_events()
+        frame_profiler.start_frame()
+        run_frame(events)
+        frame_profiler.end_frame()
+        clock.tick(FPS)  # 操作中は60FPS、マウス移動などでイベントが続く時もこれ以上は回さない
+
+    print(f"文字キャッシュ: {text_cache.stats()}")
+    pygame.quit()
 
-    pygame.display.flip()
-    clock.tick(60)
 
-pygame.quit()
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,216 @@
+# -*- coding: utf-8 -*-
+"""AirOco の day-csv エンドポイントを手元で再現するサーバー
+
+ネットワークに繋がっていない環境でも取り込みや起動のベンチマークを再現できるよう、
+合成データまたは記録済みのフィクスチャを返す。遅延・エラー率・センサー数は変更できる。
+
+    python mock_airoco.py --port 5001 --sensors 8 --latency 0.2 --error-rate 0.05
+    python mock_airoco.py --record fixtures --days 7      # 本物のAPIの応答を記録
+    python mock_airoco.py --replay fixtures               # 記録した応答を返す
+
+クライアント側は環境変数 AIROCO_API_URL でこのサーバーを指す。
+    AIROCO_API_URL='http://localhost:5001/data-api/day-csv?id=mock' python main.py
+"""
+import argparse
+import datetime
+import os
+import random
+import socketserver
+import threading
+import time
+import urllib.parse
+from wsgiref.simple_server import WSGIRequestHandler, WSGIServer, make_server
+
+import numpy as np
+
+import airoco
+import series_store
+
+
+SAMPLE_INTERVAL = series_store.SAMPLE_INTERVAL   # センサーの送信間隔(5分)
+
+
+class ThreadingWSGIServer(socketserver.ThreadingMixIn, WSGIServer):
+    """並列取得を再現できるよう、リクエストごとにスレッドで応答する"""
+    daemon_threads = True
+
+
+class QuietHandler(WSGIRequestHandler):
+    """ベンチマーク中はアクセスログを出さない"""
+    def log_message(self, *args) -> None:
+        pass
+
+
+def sensor_names(count: int) -> list:
+    """センサー名の一覧(1つ目は本番と同じ名前)"""
+    return [airoco.SENSOR_NAME] + [f'Ｒ３ー{400 + i:03d}' for i in range(2, count + 1)]
+
+
+def _noise(ts: np.ndarray, salt: float) -> np.ndarray:
+    """タイムスタンプから決まる -1～1 の擬似乱数(同じ時刻には常に同じ値を返す)"""
+    x = np.sin(ts * 12.9898 + salt * 78.233) * 43758.5453
+    return (x - np.floor(x)) * 2 - 1
+
+
+def synthetic_day_csv(start_time: int, sensors: int = 1, now: float = None) -> str:
+    """start_timeから1日分の合成day-csvを作る。nowより未来の行は含めない"""
+    now = time.time() if now is None else now
+    first = -(-start_time // SAMPLE_INTERVAL) * SAMPLE_INTERVAL
+    ts = np.arange(first, min(start_time + airoco.DAY_SECONDS, now + 1), SAMPLE_INTERVAL, dtype=np.float64)
+    phase = 2 * np.pi * (ts % airoco.DAY_SECONDS) / airoco.DAY_SECONDS
+
+    lines = []
+    for i, name in enumerate(sensor_names(sensors)):
+        co2 = np.round(650 + 200 * np.sin(phase + i) + 30 * _noise(ts, i))
+        temp = np.round(24 + 3 * np.sin(phase + i - 1) + 0.5 * _noise(ts, i + 0.3), 1)
+        humid = np.round(50 + 10 * np.sin(phase + i + 1) + 2 * _noise(ts, i + 0.6), 1)
+        for t, c, te, h in zip(ts.tolist(), co2.tolist(), temp.tolist(), humid.tolist()):
+            date = datetime.datetime.fromtimestamp(t).strftime('%Y/%m/%d %H:%M')
+            lines.append(f'{date},{name},mock,{c:g},{te:g},{h:g},{int(t)}')
+    lines.sort(key=lambda line: line.rsplit(',', 1)[1])   # 本物と同じく時刻順に混在させる
+    return '\n'.join(lines)
+
+
+def synthetic_days(days: int = 7, sensors: int = 1, now: float = None) -> list:
+    """現在までの過去days日分の合成day-csvのリスト"""
+    now = int(time.time()) if now is None else int(now)
+    return [synthetic_day_csv(now - airoco.DAY_SECONDS * i, sensors, now) for i in range(days, 0, -1)]
+
+
+class FixtureStore:
+    """記録した応答を startDate ごとのファイルとして保存・読み込みする"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def _file(self, start_time: int) -> str:
+        return os.path.join(self.path, f'{start_time}.csv')
+
+    def save(self, start_time: int, text: str) -> None:
+        os.makedirs(self.path, exist_ok=True)
+        with open(self._file(start_time), 'w', encoding='utf-8') as f:
+            f.write(text)
+
+    def start_times(self) -> list:
+        if not os.path.isdir(self.path):
+            return []
+        return sorted(int(name[:-4]) for name in os.listdir(self.path) if name.endswith('.csv'))
+
+    def load(self, start_time: int):
+        """start_time以前で最も近い記録を返す。無ければNone"""
+        candidates = [t for t in self.start_times() if t <= start_time]
+        if not candidates:
+            return None
+        with open(self._file(candidates[-1]), encoding='utf-8') as f:
+            return f.read()
+
+
+def record(path: str, days: int = 7, now: int = None) -> list:
+    """本物のAPIから過去days日分の応答を取得し、フィクスチャとして保存する"""
+    now = int(time.time()) if now is None else now
+    store = FixtureStore(path)
+    recorded = []
+    for i in range(days, 0, -1):
+        start_time = now - airoco.DAY_SECONDS * i
+        text = airoco.fetch_day_chunk(start_time)
+        if text is not None:
+            store.save(start_time, text)
+            recorded.append(start_time)
+            print(f'recorded: {start_time}')
+    return recorded
+
+
+class MockAirocoServer:
+    def __init__(self, host: str = 'localhost', port: int = 5001, sensors: int = 1,
+                 latency: float = 0.0, jitter: float = 0.0, error_rate: float = 0.0,
+                 replay: str = None, seed: int = 0):
+        self.host = host
+        self.port = port
+        self.sensors = sensors
+        self.latency = latency          # 応答までの遅延秒
+        self.jitter = jitter            # 遅延のゆらぎ(±秒)
+        self.error_rate = error_rate    # 503を返す確率
+        self.fixtures = FixtureStore(replay) if replay else None
+        self._random = random.Random(seed)
+        self.request_count = 0
+        self._httpd = None
+
+    @property
+    def url(self) -> str:
+        """AIROCO_API_URL に設定するURL"""
+        return f'http://{self.host}:{self.port}/data-api/day-csv?id=mock'
+
+    def _app(self, environ, response) -> list:
+        self.request_count += 1
+        header = [('Content-Type', 'text/csv; charset=utf-8')]
+
+        qs = urllib.parse.parse_qs(environ.get('QUERY_STRING', ''))
+        start_date = qs.get('startDate', [None])[0]
+        if environ.get('PATH_INFO') != '/data-api/day-csv' or not start_date:
+            response('404 Not Found', header)
+            return [b'Not Found']
+
+        delay = self.latency + self._random.uniform(-self.jitter, self.jitter)
+        if delay > 0:
+            time.sleep(delay)
+        if self._random.random() < self.error_rate:
+            response('503 Service Unavailable', header)
+            return [b'Service Unavailable']
+
+        if self.fixtures:
+            text = self.fixtures.load(int(start_date))
+            if text is None:
+                response('404 Not Found', header)
+                return [b'Not Found']
+        else:
+            text = synthetic_day_csv(int(start_date), self.sensors)
+
+        res = text.encode('utf-8')
+        header.append(('Content-Length', str(len(res))))
+        response('200 OK', header)
+        return [res]
+
+    def start(self) -> None:
+        with make_server(self.host, self.port, self._app, server_class=ThreadingWSGIServer) as httpd:
+            self._httpd = httpd
+            print(f'mock airoco server stating on {self.url} ...')
+            httpd.serve_forever()
+
+    def start_background(self):
+        """別スレッドで起動する(ベンチマーク用)。起動後にurlを使える"""
+        self._httpd = make_server(self.host, self.port, self._app,
+                                  server_class=ThreadingWSGIServer, handler_class=QuietHandler)
+        self.port = self._httpd.server_port   # port=0 の場合は空いているポートが割り当てられる
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+        return self
+
+    def stop(self) -> None:
+        if self._httpd:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='AirOco day-csv エンドポイントの代替サーバー')
+    parser.add_argument('--host', default='localhost')
+    parser.add_argument('--port', type=int, default=5001)
+    parser.add_argument('--sensors', type=int, default=1, help='合成データのセンサー数')
+    parser.add_argument('--latency', type=float, default=0.0, help='応答遅延(秒)')
+    parser.add_argument('--jitter', type=float, default=0.0, help='遅延のゆらぎ(秒)')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='503を返す確率(0～1)')
+    parser.add_argument('--replay', help='記録したフィクスチャのディレクトリ')
+    parser.add_argument('--record', help='本物のAPIの応答を記録するディレクトリ')
+    parser.add_argument('--days', type=int, default=7, help='記録する日数')
+    args = parser.parse_args()
+
+    if args.record:
+        record(args.record, args.days)
+        return
+
+    server = MockAirocoServer(args.host, args.port, args.sensors, args.latency, args.jitter,
+                              args.error_rate, args.replay)
+    server.start()
+
+
+if __name__ == '__main__':
+    main()
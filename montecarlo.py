@@ -0,0 +1,171 @@
+# -*- coding: utf-8 -*-
+"""短時間モードの損益分布をモンテカルロ法で調べるシミュレータ(pygame不要)
+
+記録したセンサー履歴の値の変化をブロックごとに並べ替えて(ブロック・ブートストラップ)価格の経路を作り、
+trading.Portfolio の短時間モードのルール(TICK_SECONDSごとの交渉価格の更新、FORCED_SALE_SECONDS後の90%での強制売却)で
+1経路ずつ再生する。経路はプロセスプールで並列に処理し、銘柄ごとに購入金額に対する損益率の分布を表示する。
+使い方: python montecarlo.py [--replay DIR | --synthetic] [--days 7] [--paths 20000] [--quantity 1] [--block 6] [--workers N] [--csv out.csv]
+"""
+import argparse
+import csv
+import datetime
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import backtest
+import series_store
+import trading
+
+
+TICK_SECONDS = trading.TICK_SECONDS
+SAMPLE_INTERVAL = series_store.SAMPLE_INTERVAL
+# 強制売却までに参照しうるサンプル数(購入時の前回価格 + 購入後の経過分 + 余裕)
+PATH_LENGTH = 2 + (SAMPLE_INTERVAL + trading.FORCED_SALE_SECONDS + TICK_SECONDS) // SAMPLE_INTERVAL
+PERCENTILES = (5, 25, 50, 75, 95)
+
+
+def historical_changes(values: np.ndarray, timestamps: np.ndarray) -> np.ndarray:
+    """隣り合うサンプルの値の差。センサーが止まっていた区間をまたぐ差は除く"""
+    diffs = np.diff(values)
+    continuous = np.diff(timestamps) <= SAMPLE_INTERVAL * series_store.GAP_FACTOR
+    return diffs[continuous]
+
+
+def bootstrap_paths(levels: np.ndarray, changes: np.ndarray, count: int, block: int,
+                    rng: np.random.Generator) -> np.ndarray:
+    """履歴の値から始め、連続するblock件ずつの値の変化をつないだ (count, PATH_LENGTH) の経路"""
+    if len(changes) == 0:
+        raise ValueError('値の変化を計算できるだけの履歴がありません')
+    steps = PATH_LENGTH - 1
+    block = min(block, len(changes))   # 履歴が短い時はブロックを縮めてから必要なブロック数を求める
+    blocks = -(-steps // block)
+    starts = rng.integers(0, len(changes) - block + 1, (count, blocks))
+    index = (starts[:, :, None] + np.arange(block)).reshape(count, -1)[:, :steps]
+    paths = np.empty((count, PATH_LENGTH))
+    paths[:, 0] = rng.choice(levels, count)
+    paths[:, 1:] = paths[:, :1] + np.cumsum(changes[index], axis=1)
+    return paths
+
+
+def play_special(ticker: str, path, quantity: int, offset: float, phase: float) -> tuple:
+    """1経路で短時間モードを買って放置した時の (強制売却までの損益, 途中で売った場合の最大の損益, 購入金額)
+
+    path[0]が購入時の前回価格、path[1]が購入価格。購入はサンプルからoffset秒後、
+    最初の交渉価格の更新は購入からphase秒後で、以後TICK_SECONDSごとに更新される。
+    """
+    portfolio = trading.Portfolio(money=10 ** 12, tickers=(ticker,))
+    start_money = portfolio.money
+    started = datetime.datetime(2000, 1, 1)
+    portfolio.toggle_special(ticker)
+    if portfolio.buy_special(ticker, quantity, path[1], started) is None:
+        return 0.0, 0.0, 0
+    cost = start_money - portfolio.money
+    position = portfolio.stocks[ticker]
+
+    best = -cost
+    elapsed = phase
+    while True:
+        index = 1 + int((offset + elapsed) // SAMPLE_INTERVAL)
+        fill = portfolio.tick(ticker, path[index], path[index - 1], started + datetime.timedelta(seconds=elapsed))
+        if fill is not None:   # 強制売却
+            break
+        # この時点で1株ずつ全て売った場合の損益
+        best = max(best, quantity * int(position["negotiation_price"] * trading.SELL_RATE) - cost)
+        elapsed += TICK_SECONDS
+    held = portfolio.money - start_money
+    return held, max(best, held), cost
+
+
+def simulate_chunk(ticker: str, levels: np.ndarray, changes: np.ndarray, count: int, quantity: int,
+                   block: int, seed) -> np.ndarray:
+    """count本の経路を作って再生し、(強制売却までの損益率, 最大の損益率) の (count, 2) 配列を返す(プロセスプールで実行)"""
+    rng = np.random.default_rng(seed)
+    paths = bootstrap_paths(levels, changes, count, block, rng)
+    offsets = rng.uniform(0, SAMPLE_INTERVAL, count)
+    phases = rng.uniform(0, TICK_SECONDS, count)
+    result = np.zeros((count, 2))
+    for i, (path, offset, phase) in enumerate(zip(paths.tolist(), offsets.tolist(), phases.tolist())):
+        held, best, cost = play_special(ticker, path, quantity, offset, phase)
+        if cost > 0:
+            result[i] = held / cost, best / cost
+        else:
+            result[i] = np.nan
+    return result
+
+
+def simulate(ticker: str, history: dict, paths: int, quantity: int = 1, block: int = 6, seed: int = 0,
+             workers: int = None) -> np.ndarray:
+    """ticker の短時間モードをpaths本の経路で再生し、(paths, 2) の損益率を返す(購入できなかった経路はNaN)"""
+    values = np.ascontiguousarray(history[ticker])
+    changes = historical_changes(values, history['timestamp'])
+    levels = values[values > 0]   # 0以下の価格では購入できない
+    workers = workers or os.cpu_count() or 1
+    chunks = min(paths, workers * 4)
+    counts = [paths // chunks + (i < paths % chunks) for i in range(chunks)]
+    seeds = np.random.SeedSequence([seed, trading.TICKERS.index(ticker)]).spawn(chunks)
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(simulate_chunk, ticker, levels, changes, count, quantity, block, chunk_seed)
+                   for count, chunk_seed in zip(counts, seeds)]
+        return np.concatenate([future.result() for future in futures])
+
+
+def describe(payoffs: np.ndarray) -> dict:
+    """損益率の配列の統計量"""
+    payoffs = payoffs[~np.isnan(payoffs)]
+    if len(payoffs) == 0:
+        return {}
+    row = {'mean': float(payoffs.mean()), 'std': float(payoffs.std()), 'win': float((payoffs > 0).mean())}
+    for p, value in zip(PERCENTILES, np.percentile(payoffs, PERCENTILES)):
+        row[f'p{p}'] = float(value)
+    row['min'] = float(payoffs.min())   # 交渉価格が負になると購入金額以上に失うことがある
+    row['max'] = float(payoffs.max())
+    return row
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='短時間モードの損益分布のモンテカルロシミュレーション')
+    parser.add_argument('--replay', help='記録したフィクスチャのディレクトリ(mock_airoco.py --record)')
+    parser.add_argument('--synthetic', action='store_true', help='履歴キャッシュの代わりに合成データを使う(動作確認用)')
+    parser.add_argument('--days', type=int, default=7)
+    parser.add_argument('--tickers', nargs='+', default=list(trading.TICKERS), choices=trading.TICKERS)
+    parser.add_argument('--paths', type=int, default=20000, help='銘柄ごとの経路の数')
+    parser.add_argument('--quantity', type=int, default=1, help='短時間モードで買う株数')
+    parser.add_argument('--block', type=int, default=6, help='ブートストラップでつなぐ値の変化のブロック長(サンプル数)')
+    parser.add_argument('--workers', type=int, help='プロセス数(既定はCPU数)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--csv', help='経路ごとの損益率を書き出すCSV')
+    args = parser.parse_args()
+
+    try:
+        history = backtest.load_history(args.replay, args.days, synthetic=args.synthetic)
+    except ValueError as e:
+        parser.error(str(e))
+    print(f'{len(history["timestamp"])}行 ({args.days}日分) / {args.quantity}株 / 経路 {args.paths}本 x {len(args.tickers)}銘柄')
+    columns = ['mean', 'std', 'win', 'min'] + [f'p{p}' for p in PERCENTILES] + ['max']
+    print(f'{"ticker":<7}{"exit":<8}' + ''.join(f'{c:>9}' for c in columns))
+    rows = []
+    for ticker in args.tickers:
+        start = time.perf_counter()
+        payoffs = simulate(ticker, history, args.paths, args.quantity, args.block, args.seed, args.workers)
+        elapsed = time.perf_counter() - start
+        for exit_name, column in (('forced', 0), ('best', 1)):
+            row = describe(payoffs[:, column])
+            if row:
+                print(f'{ticker:<7}{exit_name:<8}' + ''.join(f'{row[c]:>9.1%}' for c in columns))
+        print(f'{"":<7}({elapsed:.2f}秒, {args.paths / elapsed:,.0f}経路/秒)')
+        rows.extend((ticker, held, best) for held, best in payoffs.tolist())
+
+    print('forced: 強制売却まで持ち続けた場合 / best: 最も高い交渉価格で売り切った場合(損益率は購入金額に対する割合)')
+    if args.csv:
+        with open(args.csv, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['ticker', 'forced', 'best'])
+            writer.writerows(rows)
+        print(f'{len(rows)}行を {args.csv} に書き出しました')
+
+
+if __name__ == '__main__':
+    main()
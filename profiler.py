@@ -0,0 +1,108 @@
+# -*- coding: utf-8 -*-
+import csv
+import gc
+import time
+from collections import deque
+
+import numpy as np
+
+
+class FrameProfiler:
+    """1フレームの処理を段階ごとに計測し、直近maxlenフレーム分を保持する
+
+    start_frame() の後、各段階の終わりで lap(段階名) を呼ぶと、前回のlapからの経過時間が
+    その段階の時間として記録される。end_frame() でフレーム全体の時間(total)も記録する。
+    """
+
+    def __init__(self, maxlen: int = 600):
+        self.frames = deque(maxlen=maxlen)   # フレームごとの {段階名: 秒, 'gc': GCの回数}
+        self._stages = []                    # 段階名(初めて記録された順)
+        self._current = {}
+        self._start = None
+        self._last = None
+        self.gc_count = 0                    # 計測開始からのGCの回数
+        self.gc_time = 0.0                   # GCで止まった時間の合計(秒)
+        self.gc_last_pause = 0.0             # 直近のGCで止まった時間(秒)
+        self._gc_started = None
+        self._gc_frame_start = 0
+
+    def track_gc(self) -> None:
+        """GCの回数と停止時間を記録する(gc.callbacksに登録)"""
+        if self._on_gc not in gc.callbacks:
+            gc.callbacks.append(self._on_gc)
+
+    def _on_gc(self, phase: str, info: dict) -> None:
+        if phase == 'start':
+            self._gc_started = time.perf_counter()
+        elif self._gc_started is not None:
+            self.gc_last_pause = time.perf_counter() - self._gc_started
+            self.gc_time += self.gc_last_pause
+            self.gc_count += 1
+            self._gc_started = None
+
+    def start_frame(self) -> None:
+        self._current = {}
+        self._start = self._last = time.perf_counter()
+        self._gc_frame_start = self.gc_count
+
+    def lap(self, stage: str) -> None:
+        """前回のlap(またはstart_frame)からの経過時間をstageの時間として加算する"""
+        if self._last is None:
+            return
+        now = time.perf_counter()
+        self._current[stage] = self._current.get(stage, 0.0) + now - self._last
+        self._last = now
+        if stage not in self._stages:
+            self._stages.append(stage)
+
+    def end_frame(self) -> dict:
+        if self._start is None:
+            return {}
+        self._current['total'] = time.perf_counter() - self._start
+        self._current['gc'] = self.gc_count - self._gc_frame_start   # このフレーム中のGCの回数
+        frame = self._current
+        self.frames.append(frame)
+        self._start = self._last = None
+        return frame
+
+    def stages(self) -> list:
+        return self._stages + ['total']
+
+    def rolling(self, window: int = 120) -> dict:
+        """直近windowフレームの段階ごとの {'avg': 1フレームあたりの平均ミリ秒, 'max': 最大ミリ秒}"""
+        frames = list(self.frames)[-window:]
+        result = {}
+        for stage in self.stages():
+            times = [frame.get(stage, 0.0) * 1000 for frame in frames]
+            result[stage] = {'avg': sum(times) / len(times) if times else 0.0, 'max': max(times, default=0.0)}
+        return result
+
+    def export_csv(self, path: str) -> int:
+        """保持しているフレームを1行1フレーム(段階ごとのミリ秒とGCの回数)でCSVに書き出す。行数を返す"""
+        stages = self.stages()
+        with open(path, 'w', newline='', encoding='utf-8') as f:
+            writer = csv.writer(f)
+            writer.writerow(['frame'] + [f'{stage}_ms' for stage in stages] + ['gc'])
+            for i, frame in enumerate(self.frames):
+                writer.writerow([i] + [f'{frame.get(stage, 0.0) * 1000:.3f}' for stage in stages] + [frame.get('gc', 0)])
+        return len(self.frames)
+
+    def summary(self, percentiles: tuple = (50, 95, 99)) -> dict:
+        """段階ごとの {'count': 実行されたフレーム数, 'p50': ミリ秒, ..., 'max': ミリ秒}"""
+        result = {}
+        for stage in self.stages():
+            times = np.array([frame[stage] for frame in self.frames if stage in frame]) * 1000
+            row = {'count': len(times)}
+            for p in percentiles:
+                row[f'p{p}'] = float(np.percentile(times, p)) if len(times) else 0.0
+            row['max'] = float(times.max()) if len(times) else 0.0
+            result[stage] = row
+        return result
+
+    def report(self, percentiles: tuple = (50, 95, 99)) -> str:
+        """summary() を表形式の文字列にする"""
+        columns = [f'p{p}' for p in percentiles] + ['max']
+        lines = [f'{"stage":<14}{"count":>7}' + ''.join(f'{c + " ms":>10}' for c in columns)]
+        for stage, row in self.summary(percentiles).items():
+            lines.append(f'{stage:<14}{row["count"]:>7}' + ''.join(f'{row[c]:>10.3f}' for c in columns))
+        return '\n'.join(lines)
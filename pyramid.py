@@ -0,0 +1,141 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+
+LEVELS = 10   # 2^1 ～ 2^10 件ごとのバケットを持つ(5分間隔なら最大で約3.5日/バケット)
+
+
+class _Level:
+    """1段分のバケット(min/maxとその位置)。バケットjは通し番号 [j * size, (j + 1) * size) の範囲をまとめる"""
+
+    def __init__(self, size: int, base: int, mins: np.ndarray, maxs: np.ndarray, argmins: np.ndarray,
+                 argmaxs: np.ndarray):
+        self.size = size
+        self.base = base          # mins[0] に対応するバケット番号
+        self.count = len(mins)
+        capacity = max(16, self.count * 2)
+        self._arrays = [np.empty(capacity, dtype=a.dtype) for a in (mins, maxs, argmins, argmaxs)]
+        for array, values in zip(self._arrays, (mins, maxs, argmins, argmaxs)):
+            array[:self.count] = values
+
+    def extend(self, mins: np.ndarray, maxs: np.ndarray, argmins: np.ndarray, argmaxs: np.ndarray) -> None:
+        """完成したバケットを末尾に追加する(公開済みの範囲は書き換えない)"""
+        n = len(mins)
+        if self.count + n > len(self._arrays[0]):
+            capacity = max(len(self._arrays[0]) * 2, self.count + n)
+            self._arrays = [np.concatenate([a[:self.count], np.empty(capacity - self.count, dtype=a.dtype)])
+                            for a in self._arrays]
+        for array, values in zip(self._arrays, (mins, maxs, argmins, argmaxs)):
+            array[self.count:self.count + n] = values
+        self.count += n
+
+    def view(self) -> tuple:
+        """(base, mins, maxs, argmins, argmaxs) を読み取り専用のビューで返す(arg*はバケット内の位置)"""
+        views = []
+        for array in self._arrays:
+            view = array[:self.count]
+            view.flags.writeable = False
+            views.append(view)
+        return (self.base, *views)
+
+
+def _buckets(values: np.ndarray, origin: int, size: int, first: int, last: int) -> tuple:
+    """通し番号で [first * size, last * size) のバケットごとの (min, max, minの位置, maxの位置) を生データから求める"""
+    if last <= first:
+        return np.empty(0), np.empty(0), np.empty(0, dtype=np.int32), np.empty(0, dtype=np.int32)
+    block = values[first * size - origin:last * size - origin].reshape(-1, size)
+    argmins = block.argmin(axis=1)
+    argmaxs = block.argmax(axis=1)
+    rows = np.arange(len(block))
+    return block[rows, argmins], block[rows, argmaxs], argmins.astype(np.int32), argmaxs.astype(np.int32)
+
+
+def _edge(values: np.ndarray) -> tuple:
+    """バケットに満たない端数を1バケットとした (min, max, minの位置, maxの位置)"""
+    argmin, argmax = values.argmin(), values.argmax()
+    return (values[argmin:argmin + 1], values[argmax:argmax + 1],
+            np.array([argmin], dtype=np.int32), np.array([argmax], dtype=np.int32))
+
+
+class MinMaxPyramid:
+    """1列分のmin/maxピラミッド
+
+    バケットの境界は通し番号(Snapshot.origin基準)で揃えるので、先頭に行が追加されたり
+    古い行が捨てられたりしても既存のバケットはそのまま使える。追記時は新しく
+    完成したバケットだけを計算する。
+    """
+
+    def __init__(self, levels: int = LEVELS):
+        self.levels = []
+        self._depth = levels
+
+    def rebuild(self, values: np.ndarray, origin: int) -> None:
+        """生データ全体から作り直す(リセットや先頭への追加の後)"""
+        end = origin + len(values)
+        self.levels = []
+        for k in range(1, self._depth + 1):
+            size = 1 << k
+            first = -(-origin // size)   # 切り上げ
+            self.levels.append(_Level(size, first, *_buckets(values, origin, size, first, end // size)))
+
+    def extend(self, values: np.ndarray, origin: int) -> None:
+        """末尾に追記された後の生データを受け取り、新しく完成したバケットを追加する"""
+        end = origin + len(values)
+        for level in self.levels:
+            first = level.base + level.count
+            if first * level.size < origin:
+                # 追記が多すぎて未完成バケットの先頭が捨てられた場合は作り直す
+                self.rebuild(values, origin)
+                return
+            level.extend(*_buckets(values, origin, level.size, first, end // level.size))
+
+    def views(self) -> list:
+        return [level.view() for level in self.levels]
+
+
+def choose_level(count: int, max_buckets: int) -> int:
+    """count件をmax_buckets個以内のバケットに収められる最小の段(0なら生データ)"""
+    k = 0
+    while count > max_buckets << k:
+        k += 1
+    return min(k, LEVELS)
+
+
+def downsample(values: np.ndarray, levels: list, origin: int, start: int, stop: int, max_buckets: int) -> tuple:
+    """[start, stop) の範囲を最大max_buckets個程度のmin/maxに間引く
+
+    (位置, 値) を返す。位置はstartからの相対インデックス(小数)で、段を使う場合は
+    バケットごとにminとmaxの2点を実際にあった位置に、起きた順で並べる(存在しない値動きを描かないため)。
+    端の未完成バケットは生データから求める。
+    """
+    count = stop - start
+    k = choose_level(count, max_buckets)
+    if k == 0 or not levels:
+        return np.arange(count, dtype=np.float64), values[start:stop]
+
+    base, mins, maxs, argmins, argmaxs = levels[min(k, len(levels)) - 1]
+    size = 1 << min(k, len(levels))
+    a, b = origin + start, origin + stop
+    first = max(-(-a // size), base)
+    last = min(b // size, base + len(mins))
+    if last <= first:
+        return np.arange(count, dtype=np.float64), values[start:stop]
+
+    # 前後の端数(バケットに満たない部分)は生データのmin/maxで1バケットとして扱う
+    parts = []
+    if a < first * size:
+        parts.append((np.array([a]), *_edge(values[start:first * size - origin])))
+    i, j = first - base, last - base
+    parts.append((np.arange(first, last) * size, mins[i:j], maxs[i:j], argmins[i:j], argmaxs[i:j]))
+    if last * size < b:
+        parts.append((np.array([last * size]), *_edge(values[last * size - origin:stop])))
+    starts, lows, highs, low_at, high_at = (np.concatenate(column) for column in zip(*parts))
+
+    min_first = low_at <= high_at
+    positions = np.empty(len(starts) * 2)
+    positions[0::2] = starts - a + np.where(min_first, low_at, high_at)
+    positions[1::2] = starts - a + np.where(min_first, high_at, low_at)
+    result = np.empty(len(starts) * 2)
+    result[0::2] = np.where(min_first, lows, highs)
+    result[1::2] = np.where(min_first, highs, lows)
+    return positions, result
@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+from collections import OrderedDict
+
+import pygame
+
+
+class TextCache:
+    """描画済みの文字のSurfaceを (フォント, 文字列, 色, アンチエイリアス, 回転角) ごとに覚えておく
+
+    日本語のラスタライズは1フレームの中で特に重いので、同じ文字列は2回目以降使い回す。
+    返すSurfaceは共有されるので、呼び出し側で書き換えないこと。古いものから捨てる。
+    """
+
+    def __init__(self, maxsize: int = 512):
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._items = OrderedDict()
+
+    def render(self, font: pygame.font.Font, text: str, antialias: bool, color, angle: float = 0) -> pygame.Surface:
+        """font.render(text, antialias, color) と同じ。angleを指定すると回転したSurfaceを返す"""
+        key = (font, text, tuple(color), antialias, angle)
+        surface = self._items.get(key)
+        if surface is not None:
+            self.hits += 1
+            self._items.move_to_end(key)
+            return surface
+
+        self.misses += 1
+        surface = font.render(text, antialias, color)
+        if angle:
+            surface = pygame.transform.rotate(surface, angle)
+        self._items[key] = surface
+        if len(self._items) > self.maxsize:
+            self._items.popitem(last=False)
+        return surface
+
+    def hit_rate(self) -> float:
+        total = self.hits + self.misses
+        return self.hits / total if total else 0.0
+
+    def stats(self) -> str:
+        return f'hit {self.hits} / miss {self.misses} ({self.hit_rate():.1%}), {len(self._items)}件保持'
+
+
+class Layer:
+    """画面の一部分(rect)を受け持つ描画層。入力(key)が前回と変わった時だけ描き直す"""
+
+    def __init__(self, name: str, rect: pygame.Rect, draw):
+        self.name = name
+        self.rect = pygame.Rect(rect)
+        self.draw = draw       # 引数なしで呼ばれ、画面に直接描く関数
+        self.key = None
+        self.valid = False     # Falseなら次のフレームで必ず描き直す
+
+
+class LayeredScreen:
+    """静的な背景(chrome)を1度だけ描いておき、変化した層の矩形だけを画面に反映する
+
+    各層は描く前に背景の同じ範囲で塗り直され、描画は層の矩形でクリップされる。
+    """
+
+    def __init__(self, screen: pygame.Surface, draw_chrome):
+        self.screen = screen
+        self.background = pygame.Surface(screen.get_size()).convert()
+        draw_chrome(self.background)
+        self.layers = []
+        self._full = True      # 次のフレームで画面全体を反映する
+
+    def add(self, name: str, rect: pygame.Rect, draw) -> Layer:
+        layer = Layer(name, rect, draw)
+        self.layers.append(layer)
+        return layer
+
+    def invalidate(self) -> None:
+        """全ての層を描き直す(ウィンドウが再表示された時など)"""
+        self._full = True
+        for layer in self.layers:
+            layer.valid = False
+
+    def render(self, keys: list, profiler=None, overlay=None) -> list:
+        """層ごとの入力(keys)を受け取り、変わった層だけ描いて画面を更新する。更新した矩形を返す
+
+        profiler(profiler.FrameProfiler)を渡すと、層ごとの描画と画面への反映の時間を記録する。
+        overlayは全ての層の上に毎フレーム描く関数で、描いた矩形を返す(消す時はinvalidate()する)。
+        """
+        if self._full:
+            self.screen.blit(self.background, (0, 0))
+
+        dirty = []
+        for layer, key in zip(self.layers, keys):
+            if layer.valid and key == layer.key:
+                continue
+            self.screen.blit(self.background, layer.rect, layer.rect)
+            self.screen.set_clip(layer.rect)
+            try:
+                layer.draw()
+            finally:
+                self.screen.set_clip(None)
+            layer.key = key
+            layer.valid = True
+            dirty.append(layer.rect)
+            if profiler:
+                profiler.lap(f'draw:{layer.name}')
+
+        if overlay:
+            dirty.append(overlay())
+            if profiler:
+                profiler.lap('overlay')
+
+        if self._full:
+            self._full = False
+            pygame.display.flip()
+            dirty = [self.screen.get_rect()]
+        elif dirty:
+            pygame.display.update(dirty)
+        if profiler and dirty:
+            profiler.lap('display')
+        return dirty
@@ -0,0 +1,94 @@
+# -*- coding: utf-8 -*-
+import random
+import threading
+import time
+
+import numpy as np
+
+import series_store
+
+
+SAMPLE_INTERVAL = series_store.SAMPLE_INTERVAL   # センサーの送信間隔の初期値(秒)。取り込んだ時刻から学習し直す
+MARGIN = 30               # 予定時刻からこの秒数だけ待ってから取得する(APIへの反映待ち)
+MIN_MARGIN = 10
+RETRY_INTERVAL = 30       # 予定時刻を過ぎても新しいデータが無かった時の再取得間隔(秒)
+BACKOFF_BASE = 15         # 取得失敗時の待ち時間の基準(秒)
+MAX_BACKOFF = 600         # 取得失敗時の待ち時間の上限(秒)
+FALLBACK_INTERVAL = 150   # まだ何も学習していない時の取得間隔(秒)
+
+
+class FetchScheduler:
+    """センサーの送信周期に合わせて次の取得時刻を決める
+
+    最新のタイムスタンプと送信間隔から次のデータが届く時刻を予測し、その少し後に取得する。
+    予定を過ぎても届かなければ間隔を空けながら再取得し、失敗時はジッター付きの指数バックオフで待つ。
+    取得は同時に1つしか走らせない(begin()で確認する)。
+    """
+
+    def __init__(self, interval: float = SAMPLE_INTERVAL, margin: float = MARGIN, seed: int = None):
+        self.interval = interval
+        self.margin = margin
+        self.last_timestamp = None   # 取り込み済みの最新のタイムスタンプ
+        self.failures = 0            # 連続失敗回数
+        self.misses = 0              # 予定時刻を過ぎても新しいデータが無かった連続回数
+        self._lock = threading.Lock()
+        self._in_flight = False
+        self._random = random.Random(seed)
+
+    def begin(self) -> bool:
+        """取得を始めてよければTrue(すでに実行中ならFalse)"""
+        with self._lock:
+            if self._in_flight:
+                return False
+            self._in_flight = True
+            return True
+
+    def observe(self, timestamps: np.ndarray) -> None:
+        """取り込んだタイムスタンプ列から送信間隔と最新時刻を学習する"""
+        if len(timestamps) == 0:
+            return
+        recent = np.asarray(timestamps[-49:], dtype=np.float64)
+        if len(recent) > 1:
+            diffs = np.diff(recent)
+            diffs = diffs[diffs > 0]
+            if len(diffs):
+                self.interval = float(np.clip(np.median(diffs), 60, 3600))
+        self.last_timestamp = float(recent[-1])
+
+    def success(self, appended: int, timestamps: np.ndarray = None) -> None:
+        """取得が成功した時に呼ぶ。appendedは新しく追記された件数"""
+        if timestamps is not None:
+            self.observe(timestamps)
+        if appended > 0:
+            # 再取得が必要だった場合は反映待ちを長めに、一発で取れた場合は少しずつ短くする
+            if self.misses:
+                self.margin = min(self.interval / 2, self.margin * 1.5)
+            else:
+                self.margin = max(MIN_MARGIN, self.margin * 0.9)
+            self.misses = 0
+        else:
+            self.misses += 1
+        self.failures = 0
+        self._in_flight = False
+
+    def failure(self) -> None:
+        """取得が失敗した時に呼ぶ"""
+        self.failures += 1
+        self._in_flight = False
+
+    def next_delay(self, now: float = None) -> float:
+        """次の取得までの待ち時間(秒)"""
+        now = time.time() if now is None else now
+        if self.failures:
+            backoff = min(MAX_BACKOFF, BACKOFF_BASE * 2 ** (self.failures - 1))
+            return self._random.uniform(backoff / 2, backoff)   # ジッターで一斉アクセスを避ける
+        if self.last_timestamp is None:
+            return FALLBACK_INTERVAL
+
+        target = self.last_timestamp + self.interval + self.margin
+        if target > now:
+            # センサーとPCの時計がずれていても1周期以上は待たない
+            return min(target - now, self.interval + self.margin)
+        # 予定時刻を過ぎても届いていない: 間隔を伸ばしながら再取得する(最大で送信間隔まで)
+        retry = min(self.interval, RETRY_INTERVAL * 2 ** max(0, self.misses - 1))
+        return self._random.uniform(retry * 0.8, retry)
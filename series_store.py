@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+import numpy as np
+
+import pyramid
+
+
+COLUMNS = ('co2', 'temp', 'humid', 'timestamp')   # 列の並び(airoco.VALUE_COLUMNSと同じ)
+PYRAMID_COLUMNS = ('co2', 'temp', 'humid')        # min/maxピラミッドを持つ列
+SAMPLES_PER_DAY = 288                             # 5分間隔で1日288件
+SAMPLE_INTERVAL = 300                             # センサーの送信間隔(秒)
+GAP_FACTOR = 1.5                                  # 送信間隔のこの倍数以上空いたらセンサー停止とみなす
+MAX_LENGTH = SAMPLES_PER_DAY * 90                 # 既定では90日分まで保持する
+
+
+class Snapshot:
+    """ある時点の全列をまとめた不変のスナップショット
+
+    列は読み取り専用のビューで、SeriesStoreは公開済みの範囲を書き換えないため、
+    取得したスナップショットは別スレッドで更新が進んでも中身が変わらない。
+    originは先頭行の通し番号で、先頭に行が追加されると減り、古い行が捨てられると増える。
+    2つのスナップショットのoriginの差だけインデックスをずらせば同じ行を指せる。
+    gapsは (開始時刻, 再開時刻) の組で、センサーが止まっていた区間を表す。
+    """
+    __slots__ = ('version', 'columns', 'length', 'origin', 'pyramids', 'gaps')
+
+    def __init__(self, version: int, columns: dict, length: int, origin: int = 0, pyramids: dict = None,
+                 gaps: np.ndarray = None):
+        self.version = version
+        self.columns = columns
+        self.length = length
+        self.origin = origin
+        self.pyramids = pyramids or {}
+        self.gaps = np.empty((0, 2)) if gaps is None else gaps
+
+    def __len__(self) -> int:
+        return self.length
+
+    def __getitem__(self, name: str) -> np.ndarray:
+        return self.columns[name]
+
+    def window(self, name: str, start: int, stop: int) -> np.ndarray:
+        """[start, stop) の範囲をビューで返す"""
+        start = min(max(start, 0), self.length)
+        stop = min(max(stop, start), self.length)
+        return self.columns[name][start:stop]
+
+    def last(self, name: str, default: float = None):
+        """列の最新値。空ならdefault"""
+        return float(self.columns[name][-1]) if self.length else default
+
+    def downsample(self, name: str, start: int, stop: int, max_buckets: int) -> tuple:
+        """[start, stop) をピラミッドで最大max_buckets個程度のmin/maxに間引き、(位置, 値) を返す"""
+        start = min(max(start, 0), self.length)
+        stop = min(max(stop, start), self.length)
+        return pyramid.downsample(self.columns[name], self.pyramids.get(name, []), self.origin, start, stop, max_buckets)
+
+
+def find_gaps(timestamps: np.ndarray, interval: float = SAMPLE_INTERVAL) -> np.ndarray:
+    """隣り合う時刻の差が interval * GAP_FACTOR を超える区間を (開始時刻, 再開時刻) の配列で返す"""
+    index = np.flatnonzero(np.diff(timestamps) > interval * GAP_FACTOR)
+    return np.column_stack([timestamps[index], timestamps[index + 1]])
+
+
+class SeriesStore:
+    """時系列データを事前確保したNumPy配列で保持する
+
+    バッファは最大件数の2倍を確保しておき、末尾が埋まったら最新の件数分だけを
+    新しいバッファの先頭に詰め直す。これで追記は償却O(1)になり、データは常に
+    連続しているのでウィンドウはコピーなしのビューとして切り出せる。
+
+    更新のたびに全列をまとめたSnapshotを作り、属性1つの代入で公開する。
+    読み込み側(描画ループ)はロックを取らずに self.snapshot を1回読むだけでよい。
+    書き込み(reset/append/prepend/merge)は1つのスレッドからだけ行うこと。
+    """
+
+    def __init__(self, columns: tuple = COLUMNS, capacity: int = MAX_LENGTH):
+        self.columns = columns
+        self.capacity = capacity
+        self._index = {name: i for i, name in enumerate(columns)}
+        self._buf = np.empty((len(columns), capacity * 2), dtype=np.float64)
+        self._start = 0
+        self._end = 0
+        self._origin = 0
+        self._pyramids = {name: pyramid.MinMaxPyramid() for name in PYRAMID_COLUMNS if name in columns}
+        self._gaps = np.empty((0, 2))
+        self._rebuild_pyramids()   # 空の段を作っておき、reset()を経ずにappend()しても間引けるようにする
+        self.snapshot = Snapshot(0, {name: self.column(name) for name in columns}, 0)
+
+    def __len__(self) -> int:
+        return self._end - self._start
+
+    def _view(self, row: int, start: int, stop: int) -> np.ndarray:
+        view = self._buf[row, start:stop]
+        view.flags.writeable = False   # 呼び出し側からの書き換えを防ぐ
+        return view
+
+    def column(self, name: str) -> np.ndarray:
+        """列全体を読み取り専用のビューで返す"""
+        return self._view(self._index[name], self._start, self._end)
+
+    def window(self, name: str, start: int, stop: int) -> np.ndarray:
+        """[start, stop) の範囲を読み取り専用のビューで返す(コピーしない)"""
+        length = len(self)
+        start = min(max(start, 0), length)
+        stop = min(max(stop, start), length)
+        return self._view(self._index[name], self._start + start, self._start + stop)
+
+    def last(self, name: str, default: float = None):
+        """列の最新値。空ならdefault"""
+        if len(self) == 0:
+            return default
+        return float(self._buf[self._index[name], self._end - 1])
+
+    def first(self, name: str, default: float = None):
+        """列の最古値。空ならdefault"""
+        if len(self) == 0:
+            return default
+        return float(self._buf[self._index[name], self._start])
+
+    def _reallocate(self, keep: int, offset: int = 0) -> None:
+        """最新keep件だけを新しいバッファのoffset位置に移す(古いビューは古いバッファを参照し続ける)"""
+        buf = np.empty_like(self._buf)
+        buf[:, offset:offset + keep] = self._buf[:, self._end - keep:self._end]
+        self._buf = buf
+        self._start = offset
+        self._end = offset + keep
+
+    def _replace(self, data: np.ndarray, origin: int) -> None:
+        """新しいバッファに中身を丸ごと書き直す。最大件数を超える分は古い方から捨てる"""
+        dropped = max(0, len(data) - self.capacity)
+        data = data[dropped:]
+        buf = np.empty_like(self._buf)
+        buf[:, :len(data)] = data.T
+        self._buf = buf
+        self._start = 0
+        self._end = len(data)
+        self._origin = origin + dropped
+        self._rebuild_pyramids()
+        self._rebuild_gaps()
+
+    def reset(self, data: np.ndarray) -> None:
+        """(n, 列数) の配列で中身を置き換える。最大件数を超える分は古い方から捨てる"""
+        self._replace(np.asarray(data, dtype=np.float64).reshape(-1, len(self.columns)), 0)
+        self._publish()
+
+    def _table(self) -> np.ndarray:
+        """現在の中身を (n, 列数) の配列としてコピーする"""
+        return self._buf[:, self._start:self._end].T.copy()
+
+    def merge(self, data: np.ndarray) -> dict:
+        """取得した行を時刻で突き合わせて取り込む
+
+        同じ時刻の重複は後から来た行を優先し(遅れて届いた訂正として扱う)、
+        既存より新しい行は追記、古い行は先頭に追加、間に入る行は挿入する。
+        位置は二分探索(searchsorted)で求め、Pythonのループは使わない。
+        各処理の件数を返す。
+        """
+        data = np.asarray(data, dtype=np.float64).reshape(-1, len(self.columns))
+        stats = {'appended': 0, 'prepended': 0, 'inserted': 0, 'corrected': 0}
+        if len(data) == 0:
+            return stats
+
+        # 時刻順に並べ、同じ時刻が続く場合は最後の行だけを残す
+        t = self._index['timestamp']
+        data = data[np.argsort(data[:, t], kind='stable')]
+        data = data[np.r_[data[1:, t] != data[:-1, t], True]]
+
+        if len(self) == 0:
+            self.reset(data)
+            stats['appended'] = len(self)
+            return stats
+
+        ts = self.column('timestamp')
+        newer = data[:, t] > ts[-1]
+        older = data[:, t] < ts[0]
+        middle = data[~newer & ~older]
+
+        if len(middle):
+            pos = np.searchsorted(ts, middle[:, t])
+            exact = ts[pos] == middle[:, t]
+            # 重なった行だけを既存の値と比べ、何も変わらなければ全体のコピーはしない
+            stored = self._buf[:, self._start + pos[exact]].T
+            changed = np.any(stored != middle[exact], axis=1)
+            inserts = middle[~exact]
+            if changed.any() or len(inserts):
+                table = self._table()
+                table[pos[exact][changed]] = middle[exact][changed]
+                table = np.insert(table, pos[~exact], inserts, axis=0)
+                self._replace(table, self._origin)
+                self._publish()
+            stats['corrected'] = int(changed.sum())
+            stats['inserted'] = len(inserts)
+
+        if older.any():
+            stats['prepended'] = self.prepend(data[older])
+        if newer.any():
+            stats['appended'] = self.append(data[newer])
+        return stats
+
+    def append(self, data: np.ndarray) -> int:
+        """(n, 列数) の配列を末尾に追記する。最大件数を超えた分は古い方から捨てる"""
+        data = np.asarray(data, dtype=np.float64).reshape(-1, len(self.columns))
+        n = len(data)
+        if n == 0:
+            return 0
+        if n >= self.capacity:
+            self.reset(data)
+            return n
+
+        reallocated = self._end + n > self._buf.shape[1]
+        if reallocated:
+            keep = min(len(self), self.capacity - n)
+            self._origin += len(self) - keep
+            self._reallocate(keep)
+        self._buf[:, self._end:self._end + n] = data.T
+        self._end += n
+        if len(self) > self.capacity:
+            dropped = len(self) - self.capacity
+            self._start += dropped
+            self._origin += dropped
+
+        # 詰め直した時は捨てた行のバケットも消すため作り直す(償却O(1))。通常は完成したバケットだけ追加
+        if reallocated:
+            self._rebuild_pyramids()
+        else:
+            for name, levels in self._pyramids.items():
+                levels.extend(self.column(name), self._origin)
+        self._extend_gaps(n)
+        self._publish()
+        return n
+
+    def prepend(self, data: np.ndarray) -> int:
+        """既存より古い (n, 列数) の配列を先頭に追加する
+
+        最大件数に収まる分(新しい側から)だけを追加し、追加した件数を返す。
+        """
+        data = np.asarray(data, dtype=np.float64).reshape(-1, len(self.columns))
+        n = min(len(data), self.capacity - len(self))
+        if n <= 0:
+            return 0
+        data = data[len(data) - n:]
+
+        # 先頭に空きがなければ、最大件数まで前に追加できる位置へ詰め直す
+        if self._start < n:
+            self._reallocate(len(self), self.capacity - len(self))
+        self._buf[:, self._start - n:self._start] = data.T
+        self._start -= n
+        self._origin -= n
+        self._rebuild_pyramids()
+        self._rebuild_gaps()
+        self._publish()
+        return n
+
+    def _rebuild_pyramids(self) -> None:
+        for name, levels in self._pyramids.items():
+            levels.rebuild(self.column(name), self._origin)
+
+    def _rebuild_gaps(self) -> None:
+        if 'timestamp' in self._index:
+            self._gaps = find_gaps(self.column('timestamp'))
+
+    def _extend_gaps(self, n: int) -> None:
+        """末尾に追記したn件(と直前の1件)の間だけを調べて停止区間を追加する"""
+        if 'timestamp' not in self._index:
+            return
+        ts = self.column('timestamp')
+        new_gaps = find_gaps(ts[max(0, len(ts) - n - 1):])
+        if len(new_gaps):
+            self._gaps = np.concatenate([self._gaps, new_gaps])
+
+    def _publish(self) -> None:
+        """現在の全列をSnapshotにまとめ、1回の代入で差し替える"""
+        columns = {name: self.column(name) for name in self.columns}
+        pyramids = {name: levels.views() for name, levels in self._pyramids.items()}
+        gaps = self._gaps
+        if len(gaps) and 'timestamp' in columns and len(self):
+            gaps = gaps[gaps[:, 1] > columns['timestamp'][0]]   # 捨てた行より前の区間は除く
+            self._gaps = gaps
+        self.snapshot = Snapshot(self.snapshot.version + 1, columns, len(self), self._origin, pyramids, gaps)
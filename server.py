@@ -36,7 +36,9 @@ class UserDB:
         SELECT *, RANK() OVER(ORDER BY money DESC) as ranking FROM {TABLE_NAME} WHERE user_name = ?
     '''                                # IDで検索
 
-    def __init__(self):
+    def __init__(self, db_name: str = None):
+        if db_name:
+            self.DB_NAME = db_name     # 別のDBファイルを使う(アリーナの結果の書き込みなど)
         if not os.path.isfile(self.DB_NAME):
             self._execute(self.CREATE_TABLE)
 
@@ -3,6 +3,7 @@ import pygame
 import sys
 import time, csv, requests, datetime
 import numpy as np
+from airoco import SENSOR_NAME
 
 def get_past_7_days_co2(initial_load=True):
     """
@@ -23,7 +24,7 @@ def get_past_7_days_co2(initial_load=True):
             next(raw_data, None)
 
             for row in raw_data:
-                if len(row) >= 7 and row[1] == 'Ｒ３ー４０１':
+                if len(row) >= 7 and row[1] == SENSOR_NAME:
                     try:
                         data.append(list(map(float, [row[3], row[6]])))
                     except (ValueError, IndexError):
@@ -3,6 +3,7 @@ import pygame
 import sys
 import time, csv, requests, datetime
 import numpy as np
+from airoco import SENSOR_NAME
 import math
 
 # 過去7日間のCO2濃度データをAPIから取得する関数 get_past_7_days_co2
@@ -23,7 +24,7 @@ def get_airoco_data():
             raw_data = csv.reader(res.text.strip().splitlines())
 
             for row in raw_data:
-                if row[1] == 'Ｒ３ー４０１':
+                if row[1] == SENSOR_NAME:
                     data.append(list(map(float, row[3:7])))  # CO2濃度, 気温, 湿度, タイムスタンプ
         except requests.exceptions.RequestException as e:
             print(f"API request failed: {e}")
@@ -3,6 +3,7 @@ import pygame
 import sys
 import time, csv, requests, datetime
 import numpy as np
+from airoco import SENSOR_NAME
 
 def get_data(initial_load=True):
     """
@@ -22,7 +23,7 @@ def get_data(initial_load=True):
             next(raw_data, None)
 
             for row in raw_data:
-                if len(row) >= 7 and row[1] == 'Ｒ３ー４０１':
+                if len(row) >= 7 and row[1] == SENSOR_NAME:
                     try:
                         # CO2, 気温, 湿度, タイムスタンプ の順でデータを取得
                         data.append(list(map(float, [row[3], row[4], row[5], row[6]])))
@@ -0,0 +1,230 @@
+# -*- coding: utf-8 -*-
+"""売買のルール(所持金・保有株・短時間モード)をまとめたモジュール
+
+pygameに依存しないので、画面を出さずに売買のシミュレーションやベンチマークに使える。
+main.py はキー入力を Portfolio の注文APIに渡して結果を表示するだけにする。
+"""
+import datetime
+import math
+
+
+TICKERS = ("co2", "temp", "humid")
+LOT_SIZES = {"co2": 1, "temp": 10, "humid": 10}   # 通常購入の単位(CO2株は1株、気温・湿度株は10株)
+SELL_RATE = 0.9                                   # 売却時は10%の手数料を引く
+FORCED_SALE_SECONDS = 3600                        # 短時間モードはこの秒数を過ぎると強制売却
+TICK_SECONDS = 150                                # 交渉価格の更新間隔(main.py・シミュレータ共通)
+
+# 短時間モードの状態
+SPECIAL_OFF = "OFF"
+SPECIAL_SELECTING = "SELECTING"
+SPECIAL_ACTIVE = "ACTIVE"
+
+
+def new_position() -> dict:
+    """1銘柄分の保有状況(client.post_user_data でそのまま送れる形)"""
+    # 保有数, 合計購入価格, 合計売値金, 損益, 特別株数, 交渉価格
+    return {"stock": 0, "buy_price": 0, "sell_price": 0, "profit": 0, "special_stocks": 0, "negotiation_price": 0}
+
+
+def special_mode_calculate(now_price, last_price, time, negotiation_price):
+    magnification = 1.0 +  0.25 * math.exp(time)                    # 特別倍率 = 1.0 + 0.25 * e^(時間経過)
+
+    if last_price == 0:
+        rate = 0.0
+    else:
+        rate = (now_price - last_price) / last_price                # 価格変動率 = (現在価格 - 前回価格) / 前回価格
+
+    bonus = 1 + (rate * magnification)                              # ボーナス計算
+
+    if negotiation_price == 0:
+        new_negotiation_price = int(last_price * bonus)             # ボーナスを適用した価格
+    else:
+        new_negotiation_price = int(negotiation_price * bonus)
+
+    return new_negotiation_price
+
+
+class Fill:
+    """約定の結果。amountは所持金の増減(買いは負)"""
+    __slots__ = ("ticker", "side", "quantity", "price", "amount")
+
+    def __init__(self, ticker: str, side: str, quantity: int, price: float, amount: int):
+        self.ticker = ticker
+        self.side = side            # "buy" / "sell" / "buy_special" / "sell_special" / "forced_sale"
+        self.quantity = quantity
+        self.price = price          # 1株あたりの価格(売りは手数料を引く前)
+        self.amount = amount
+
+    def __repr__(self) -> str:
+        return f"Fill({self.ticker}, {self.side}, {self.quantity}, {self.price}, {self.amount})"
+
+
+class Portfolio:
+    """1人分の所持金・保有株・短時間モードの状態と、それを変える注文処理
+
+    注文が通らなかった場合はNoneを返し、状態は変えない。時刻(now)を省略すると現在時刻を使う。
+    価格が0以下(データ取得前など)の時は売買できない。
+    損益は約定か価格の更新があった銘柄だけ計算し直し、合計(total_profit)も差分で更新する。
+    """
+
+    def __init__(self, money: int = 0, tickers: tuple = TICKERS):
+        self.money = money
+        self.stocks = {ticker: new_position() for ticker in tickers}
+        self.special_state = {ticker: SPECIAL_OFF for ticker in tickers}
+        self.cooldown = {ticker: None for ticker in tickers}   # 短時間モードの開始時刻
+        self.prices = {ticker: 0.0 for ticker in tickers}      # 評価に使う現在価格
+        self.total_profit = 0.0                                # 全銘柄の損益の合計
+
+    def restore(self, money: int, backuped_stocks: dict) -> None:
+        """APIサーバにバックアップした所持金と保有株数を読み込む"""
+        self.money = money
+        for ticker, position in self.stocks.items():
+            if ticker in backuped_stocks:
+                position["stock"] = backuped_stocks[ticker].get("stock", 0)
+                position["special_stocks"] = backuped_stocks[ticker].get("special_stocks", 0)
+            self._revalue(ticker)
+
+    # --- 通常モード ---
+    def buy(self, ticker: str, price: float):
+        """通常購入(Bキー)。LOT_SIZES単位で買う"""
+        if price <= 0 or self.money < price or self.special_state[ticker] == SPECIAL_ACTIVE:
+            return None
+        # 株数の入力中(SELECTING)は通常購入として扱う(従来の動作)
+        quantity = LOT_SIZES.get(ticker, 1)
+        if self.money < price * quantity:
+            return None
+        cost = int(price * quantity)
+        position = self.stocks[ticker]
+        position["stock"] += quantity
+        position["buy_price"] += cost
+        self.money -= cost
+        self._revalue(ticker)
+        return Fill(ticker, "buy", quantity, price, -cost)
+
+    def sell(self, ticker: str, price: float):
+        """売却(Sキー)。1株ずつ売る。短時間モード中は交渉価格で特別株を売る"""
+        if price <= 0:
+            return None
+        position = self.stocks[ticker]
+        if self.special_state[ticker] == SPECIAL_ACTIVE:
+            if position["special_stocks"] <= 0:
+                return None
+            negotiation_price = position["negotiation_price"]
+            proceeds = int(negotiation_price * SELL_RATE)   # 10%手数料を引く
+            position["special_stocks"] -= 1
+            position["sell_price"] += proceeds
+            self.money += proceeds
+            if position["special_stocks"] == 0:   # 売り切ったらモード解除
+                self._end_special(ticker)
+            self._revalue(ticker)
+            return Fill(ticker, "sell_special", 1, negotiation_price, proceeds)
+
+        if position["stock"] <= 0:
+            return None
+        proceeds = int(price * SELL_RATE)   # 10%手数料を引く
+        position["stock"] -= 1
+        position["sell_price"] += proceeds
+        self.money += proceeds
+        self._revalue(ticker)
+        return Fill(ticker, "sell", 1, price, proceeds)
+
+    # --- 短時間モード ---
+    def toggle_special(self, ticker: str) -> str:
+        """短時間モードのボタン。OFFなら株数の入力を始め、入力中なら取りやめる。新しい状態を返す"""
+        if self.special_state[ticker] == SPECIAL_OFF:
+            self.special_state[ticker] = SPECIAL_SELECTING
+        elif self.special_state[ticker] == SPECIAL_SELECTING:
+            self.special_state[ticker] = SPECIAL_OFF
+        return self.special_state[ticker]
+
+    def buy_special(self, ticker: str, quantity: int, price: float, now: datetime.datetime = None):
+        """株数を入力して購入を確定する(Enterキー)。短時間モードが始まる"""
+        if self.special_state[ticker] != SPECIAL_SELECTING or quantity <= 0 or price <= 0:
+            return None
+        if self.money < price * quantity:
+            return None
+        cost = int(price * quantity)
+        position = self.stocks[ticker]
+        position["special_stocks"] += quantity
+        position["buy_price"] += cost
+        self.money -= cost
+        self.special_state[ticker] = SPECIAL_ACTIVE
+        position["negotiation_price"] = price   # 交渉価格は現在の価格から始める
+        self.cooldown[ticker] = now or datetime.datetime.now()
+        self._revalue(ticker)
+        return Fill(ticker, "buy_special", quantity, price, -cost)
+
+    def tick(self, ticker: str, now_price: float, last_price: float, now: datetime.datetime = None):
+        """データ更新ごとの処理。短時間モード中なら交渉価格を更新し、制限時間を過ぎていれば強制売却する
+
+        強制売却した場合はそのFillを返す。
+        """
+        started = self.cooldown[ticker]
+        if self.special_state[ticker] != SPECIAL_ACTIVE or not started:
+            return None
+        position = self.stocks[ticker]
+        elapsed = ((now or datetime.datetime.now()) - started).total_seconds()
+
+        if elapsed > FORCED_SALE_SECONDS and position["special_stocks"] > 0:
+            quantity = position["special_stocks"]
+            negotiation_price = position["negotiation_price"]
+            proceeds = int(quantity * negotiation_price * SELL_RATE)   # 強制売却価格
+            self.money += proceeds
+            position["sell_price"] += proceeds
+            position["special_stocks"] = 0
+            self._end_special(ticker)
+            self._revalue(ticker)
+            return Fill(ticker, "forced_sale", quantity, negotiation_price, proceeds)
+
+        new_price = special_mode_calculate(now_price, last_price, elapsed / 3600.0, position["negotiation_price"])
+        position["negotiation_price"] = float(new_price)
+        self._revalue(ticker)
+        return None
+
+    def _end_special(self, ticker: str) -> None:
+        self.special_state[ticker] = SPECIAL_OFF
+        self.cooldown[ticker] = None
+        self.stocks[ticker]["negotiation_price"] = 0.0
+
+    def execute(self, orders) -> list:
+        """(注文の種類, 銘柄, 価格) の列をまとめて順に処理し、約定したFillのリストを返す
+
+        注文の種類は "buy" / "sell"。シミュレーションやベンチマーク用。
+        """
+        handlers = {"buy": self.buy, "sell": self.sell}
+        fills = []
+        for side, ticker, price in orders:
+            fill = handlers[side](ticker, price)
+            if fill is not None:
+                fills.append(fill)
+        return fills
+
+    # --- 評価 ---
+    def _revalue(self, ticker: str) -> None:
+        """1銘柄の損益を計算し直し、合計に差分を反映する"""
+        position = self.stocks[ticker]
+        possession_money = position["sell_price"] + position["stock"] * self.prices[ticker]  # 現在の持ち金 = 売却済み資産 + 現在の株価 * 保有株数
+        if self.special_state[ticker] == SPECIAL_ACTIVE:
+            possession_money += position["special_stocks"] * position["negotiation_price"]
+        profit = possession_money - position["buy_price"]   # 損益 = 現在の持ち金 - 購入金額
+        self.total_profit += profit - position["profit"]
+        position["profit"] = profit
+
+    def update_price(self, ticker: str, price: float) -> None:
+        """価格の更新。変わった場合だけその銘柄の損益を計算し直す"""
+        if self.prices[ticker] != price:
+            self.prices[ticker] = price
+            self._revalue(ticker)
+
+    def update_prices(self, prices: dict) -> None:
+        for ticker, price in prices.items():
+            self.update_price(ticker, price)
+
+    def revalue(self, prices: dict = None) -> float:
+        """全銘柄の損益を計算し直し、合計を返す(pricesを渡すとその価格で評価する)"""
+        if prices:
+            self.prices.update(prices)
+        for ticker in self.stocks:
+            self._revalue(ticker)
+        self.total_profit = sum(position["profit"] for position in self.stocks.values())   # 差分の積み重ねによる誤差を消す
+        return self.total_profit